@@ -0,0 +1,13 @@
+"""
+Benchmarks for alterable: generate a synthetic project, time each phase of
+running it, and compare the results against a baseline.
+
+    python -m benchmarks run --files 5000 --plugins 32 --output new.json
+    python -m benchmarks run --baseline old.json --threshold 0.2
+    python -m benchmarks compare old.json new.json
+    python -m benchmarks startup --budget-ms 150
+
+alterable has to be importable (pip install -e . or PYTHONPATH=src). Results
+depend on the machine, so baselines are not kept in the repository: record
+one on the machine that runs the comparison.
+"""
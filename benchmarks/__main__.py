@@ -0,0 +1,163 @@
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Any, Optional
+
+from alterable.buildsystem.runner import RunnerOptions
+from alterable.plugins.structure import PluginData
+
+from .phases import PHASES, TimingsT, benchmark
+from .startup import check as check_startup
+from .synthetic import GRAPH_SHAPES, Shape
+
+
+def compare(
+    baseline: dict[str, Any],
+    results: dict[str, Any],
+    threshold: float,
+    min_delta: float,
+) -> list[str]:
+    """
+    Print each phase next to the baseline. Returns the phases whose median
+    got slower by more than threshold (a fraction) and min_delta seconds.
+    """
+    if baseline["shape"] != results["shape"]:
+        print("warning: the baseline was recorded on a different project shape")
+    if baseline["environment"] != results["environment"]:
+        print("warning: the baseline was recorded in a different environment")
+    regressed = []
+    for phase in PHASES:
+        before = baseline["phases"].get(phase, {}).get("median")
+        after = results["phases"][phase]["median"]
+        if before is None:
+            print(f"  {phase:<12} {after * 1000:10.2f} ms  (not in baseline)")
+            continue
+        change = (after - before) / before if before else 0.0
+        slower = change > threshold and after - before > min_delta
+        if slower:
+            regressed.append(phase)
+        print(
+            f"  {phase:<12} {before * 1000:10.2f} ms -> {after * 1000:10.2f} ms  "
+            f"{change:+7.1%}" + ("  REGRESSION" if slower else "")
+        )
+    return regressed
+
+
+def _print_run(run: int, timings: TimingsT):
+    print(
+        f"run {run + 1}: "
+        + ", ".join(f"{phase} {timings[phase] * 1000:.1f} ms" for phase in PHASES)
+    )
+
+
+def _load(path: Path) -> dict[str, Any]:
+    with open(path) as f:
+        return json.load(f)
+
+
+def parse_args(argv: Optional[list[str]]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="generate a project and time it")
+    defaults = Shape()
+    for field, default in defaults._asdict().items():
+        if field == "graph":
+            continue
+        run.add_argument(
+            f"--{field.replace('_', '-')}", type=type(default), default=default
+        )
+    run.add_argument("--graph", choices=GRAPH_SHAPES, default=defaults.graph)
+    run.add_argument("--executor", choices=PluginData.EXECUTORS, default="serial")
+    run.add_argument("--workers", type=int)
+    run.add_argument("--sandbox", default="copy")
+    run.add_argument("--repeats", type=int, default=5)
+    run.add_argument("--warmup", type=int, default=1)
+    run.add_argument("--output", type=Path, help="write the results here")
+    run.add_argument("--baseline", type=Path, help="compare against these results")
+
+    check = commands.add_parser("compare", help="compare two saved results")
+    check.add_argument("baseline", type=Path)
+    check.add_argument("results", type=Path)
+
+    startup = commands.add_parser(
+        "startup", help="check the time startup imports take against a budget"
+    )
+    startup.add_argument(
+        "--budget-ms",
+        type=float,
+        default=150.0,
+        help="fail when the median import time is above this " "(default: %(default)s)",
+    )
+    startup.add_argument("--repeats", type=int, default=5)
+
+    for command in (run, check):
+        command.add_argument(
+            "--threshold",
+            type=float,
+            default=0.15,
+            help="fail when a phase's median is slower by more than this "
+            "fraction of the baseline (default: %(default)s)",
+        )
+        command.add_argument(
+            "--min-delta-ms",
+            type=float,
+            default=1.0,
+            help="ignore changes smaller than this, however large relative "
+            "to the baseline (default: %(default)s)",
+        )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    args = parse_args(argv)
+    if args.command == "startup":
+        problems = check_startup(args.budget_ms, args.repeats)
+        for problem in problems:
+            print(problem)
+        return 1 if problems else 0
+    if args.command == "compare":
+        baseline, results = _load(args.baseline), _load(args.results)
+    else:
+        shape = Shape(
+            **{field: getattr(args, field) for field in Shape._fields},
+        )
+        options = RunnerOptions.load(
+            {
+                "executor": args.executor,
+                "workers": args.workers,
+                "sandbox": args.sandbox,
+            }
+        )
+        results = benchmark(
+            shape,
+            options,
+            repeats=args.repeats,
+            warmup=args.warmup,
+            progress=_print_run,
+        )
+        print(
+            "median: "
+            + ", ".join(
+                f"{phase} {results['phases'][phase]['median'] * 1000:.1f} ms"
+                for phase in PHASES
+            )
+        )
+        if args.output is not None:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+            print(f"results written to {args.output}")
+        if args.baseline is None:
+            return 0
+        baseline = _load(args.baseline)
+    regressed = compare(baseline, results, args.threshold, args.min_delta_ms / 1000)
+    if regressed:
+        print(f"slower than the baseline: {', '.join(regressed)}")
+        return 1
+    print("no regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""
+Times each phase of a preprocessing run on a synthetic project, the same way
+the CLI runs them, and keeps the median of several repeats.
+"""
+
+import contextlib
+import logging
+import platform
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+from alterable.buildsystem.cli import collect, prepare_env
+from alterable.buildsystem.resolves import compute
+from alterable.buildsystem.runner import RunnerOptions, run_steps
+from alterable.plugins.prepare import prepare
+from alterable.plugins.shared_context import ProjectContext
+from alterable.plugins.structure import PluginSpec, UserPluginSpec
+
+from .synthetic import Project, Shape, generate
+
+PHASES = ["collect", "prepare_env", "resolve", "prepare", "run_steps"]
+
+TimingsT = dict[str, float]
+
+
+@contextlib.contextmanager
+def _timed(timings: TimingsT, phase: str) -> Iterator[None]:
+    start = time.perf_counter()
+    yield
+    timings[phase] = time.perf_counter() - start
+
+
+def _providers(plugins: dict[str, PluginSpec]) -> dict[str, list[PluginSpec]]:
+    providers: dict[str, list[PluginSpec]] = defaultdict(list)
+    for plugin in plugins.values():
+        for slot in plugin.provides:
+            providers[slot].append(plugin)
+    return providers
+
+
+def run_once(project: Project, options: RunnerOptions) -> TimingsT:
+    timings: TimingsT = {}
+    plugins = {
+        name: UserPluginSpec.load(name, template)
+        for name, template in project.plugins.items()
+    }
+    with _timed(timings, "collect"):
+        sources = collect([str(project.sources)])
+    with contextlib.ExitStack() as stack:
+        with _timed(timings, "prepare_env"):
+            sandbox = Path(stack.enter_context(prepare_env(sources, options.sandbox)))
+        with _timed(timings, "resolve"):
+            ok, plan = compute(
+                plugins, _providers(plugins), "benchmark", project.requirements
+            )
+        if not ok:
+            raise RuntimeError("the synthetic provider graph has no solution")
+        # matching on its own: run_steps does it again, on a fresh context
+        with (
+            _timed(timings, "prepare"),
+            contextlib.closing(
+                ProjectContext(options.memory_budget, options.write_buffer)
+            ) as ctx,
+        ):
+            for step in plan:
+                prepare(plugins[step.name], sandbox, ctx)
+        with _timed(timings, "run_steps"):
+            run_steps(sandbox, plan, plugins, options)
+    return timings
+
+
+def _environment() -> dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "system": platform.system(),
+    }
+
+
+def benchmark(
+    shape: Shape,
+    options: RunnerOptions,
+    *,
+    repeats: int = 5,
+    warmup: int = 1,
+    progress: Callable[[int, TimingsT], None] = lambda run, timings: None,
+) -> dict[str, Any]:
+    """
+    Generate the project once, run it warmup + repeats times and summarize
+    the timed runs. Logging is turned off meanwhile: it would be most of
+    what gets measured.
+    """
+    runs: list[TimingsT] = []
+    logging.disable(logging.CRITICAL)
+    try:
+        with tempfile.TemporaryDirectory(prefix="alterable-bench-") as root:
+            project = generate(shape, Path(root))
+            for run in range(warmup + repeats):
+                timings = run_once(project, options)
+                if run >= warmup:
+                    runs.append(timings)
+                    progress(run - warmup, timings)
+    finally:
+        logging.disable(logging.NOTSET)
+    return {
+        "shape": shape._asdict(),
+        "options": {
+            "executor": options.executor,
+            "workers": options.workers,
+            "sandbox": options.sandbox,
+        },
+        "environment": _environment(),
+        "repeats": repeats,
+        "phases": {
+            phase: {
+                "median": statistics.median(run[phase] for run in runs),
+                "min": min(run[phase] for run in runs),
+                "max": max(run[phase] for run in runs),
+            }
+            for phase in PHASES
+        },
+    }
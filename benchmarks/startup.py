@@ -0,0 +1,36 @@
+"""
+Startup check: how long a fresh interpreter takes to import what a build
+needs before it starts working, against a budget, and whether anything
+that should only be imported on demand got imported.
+"""
+
+import statistics
+
+from alterable.buildsystem.startup import measure
+
+# imported once a configuration has to be validated, or something logged
+DEFERRED = ["rich", "strictyaml"]
+
+
+def check(budget_ms: float, repeats: int = 5) -> list[str]:
+    """
+    Problems found: the median total import time over budget_ms, and the
+    deferred packages imported at startup.
+    """
+    totals = []
+    imported: set[str] = set()
+    for _ in range(repeats):
+        modules = measure()
+        totals.append(sum(self_us for _, self_us, _ in modules) / 1000)
+        imported.update(name.split(".")[0] for name, _, _ in modules)
+    total = statistics.median(totals)
+    print(
+        f"startup imports: {total:.1f} ms (median of {repeats}), budget {budget_ms:.1f} ms"
+    )
+    problems = []
+    if total > budget_ms:
+        problems.append(f"startup took {total:.1f} ms, over {budget_ms:.1f} ms")
+    for package in DEFERRED:
+        if package in imported:
+            problems.append(f"{package} is imported at startup")
+    return problems
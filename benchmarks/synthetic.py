@@ -0,0 +1,144 @@
+"""
+Synthetic projects: a tree of source files and a set of file plugins whose
+provider graph has a chosen shape. Everything is derived from a seed, so the
+same Shape always generates the same project.
+"""
+
+import math
+import random
+from pathlib import Path
+from typing import Any, NamedTuple
+
+GRAPH_SHAPES = ["flat", "chain", "layered", "alternatives"]
+EXTENSIONS = ["html", "css", "js", "md", "txt"]
+
+PLUGIN_SOURCE = """\
+import hashlib
+
+
+def read(path, ctx):
+    hashlib.blake2b(ctx.data.buffer).digest()
+
+
+def rewrite(path, ctx):
+    ctx.write(ctx.data.content + "\\n")
+"""
+
+
+class Shape(NamedTuple):
+    files: int = 2000
+    # file sizes are lognormal around the median, clamped to max_size
+    median_size: int = 4096
+    size_sigma: float = 1.0
+    max_size: int = 1024 * 1024
+    # how deep the directory tree goes, and how many directories per level
+    depth: int = 4
+    branching: int = 4
+    plugins: int = 16
+    graph: str = "layered"
+    # every n-th plugin writes the files it matches instead of only reading
+    rewrite_every: int = 4
+    seed: int = 0
+
+
+class Project(NamedTuple):
+    root: Path
+    sources: Path
+    # plugin name -> template, as UserPluginSpec.load takes it
+    plugins: dict[str, dict[str, Any]]
+    # the slots the preprocessing plan asks for
+    requirements: list[str]
+
+
+def _file_sizes(shape: Shape, rng: random.Random) -> list[int]:
+    mu = math.log(max(shape.median_size, 1))
+    return [
+        min(int(rng.lognormvariate(mu, shape.size_sigma)), shape.max_size)
+        for _ in range(shape.files)
+    ]
+
+
+def _directory(shape: Shape, rng: random.Random) -> Path:
+    parts = [
+        f"d{rng.randrange(shape.branching)}" for _ in range(rng.randint(0, shape.depth))
+    ]
+    return Path(*parts)
+
+
+def write_sources(shape: Shape, root: Path):
+    rng = random.Random(shape.seed)
+    for i, size in enumerate(_file_sizes(shape, rng)):
+        ext = EXTENSIONS[i % len(EXTENSIONS)]
+        path = root / _directory(shape, rng) / f"f{i}.{ext}"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # printable and compressible enough to look like text
+        line = f"{path.name} {i} ".ljust(63, "x") + "\n"
+        path.write_text((line * (size // len(line) + 1))[:size])
+
+
+def provider_graph(count: int, shape: str) -> tuple[list[dict], list[str]]:
+    """
+    'use' and 'provides' for count plugins (in order), and the slots that
+    the plan requires:
+
+    - flat: independent plugins, all required
+    - chain: every plugin uses the next one
+    - layered: square-ish layers, every plugin uses two of the layer below
+    - alternatives: two providers for every slot; the first provider of the
+      last slot loops back to the first, so the resolver has to backtrack
+    """
+    if shape == "flat":
+        return [{"provides": [f"s{i}"]} for i in range(count)], [
+            f"s{i}" for i in range(count)
+        ]
+    if shape == "chain":
+        return [
+            {"provides": [f"s{i}"], "use": [f"s{i + 1}"] if i + 1 < count else []}
+            for i in range(count)
+        ], ["s0"]
+    if shape == "layered":
+        width = max(1, math.isqrt(count))
+        graph = []
+        for i in range(count):
+            below = [j for j in (i + width, i + width + 1) if j < count]
+            if below and i // width + 1 < below[-1] // width:
+                below = below[:1]  # stay on the next layer
+            graph.append({"provides": [f"s{i}"], "use": [f"s{j}" for j in below]})
+        return graph, [f"s{i}" for i in range(min(width, count))]
+    if shape == "alternatives":
+        slots = max(1, count // 2)
+        graph = []
+        for i in range(count):
+            slot = i % slots
+            first = i < slots
+            if slot + 1 < slots:
+                use = [f"s{slot + 1}"]
+            else:
+                use = ["s0"] if first else []
+            graph.append({"provides": [f"s{slot}"], "use": use})
+        return graph, ["s0"]
+    raise ValueError(f"unknown graph shape: {shape}")
+
+
+def generate(shape: Shape, root: Path) -> Project:
+    """
+    Write the sources and the plugin module under root.
+    """
+    sources = root / "site"
+    write_sources(shape, sources)
+    module = root / "bench_plugins.py"
+    module.write_text(PLUGIN_SOURCE)
+    graph, requirements = provider_graph(shape.plugins, shape.graph)
+    plugins = {}
+    for i, edges in enumerate(graph):
+        writes = shape.rewrite_every > 0 and i % shape.rewrite_every == 0
+        plugins[f"p{i}"] = {
+            **edges,
+            "path": str(module),
+            "pipeline": {
+                "target": "file",
+                "match": [rf"\.{EXTENSIONS[i % len(EXTENSIONS)]}$"],
+                "entrypoint": "rewrite" if writes else "read",
+            },
+        }
+    return Project(root, sources, plugins, requirements)
@@ -1,29 +1,55 @@
+import argparse
 import contextlib
 import logging
 import os
-import shutil
 from collections import defaultdict
 from glob import glob
 from pathlib import Path
-from tempfile import TemporaryDirectory
 from typing import NoReturn, Optional
 
-from rich.logging import RichHandler
-
 from ..contrib_plugins import list_builtins
+from ..plugins.shared_context import ProjectContext
 from ..plugins.structure import PluginSpec, UserPluginSpec
-from .configloader import load as load_config
+from ..util import cache_dir
+from . import configcache, trace
+from .configcache import load_data as load_config
+from .incremental import BuildManifest, prune_objects
+from .resolves import DepLoadStruct, ResolveGraph
 from .resolves import compute as solve_compute
-from .runner import run_steps
+from .runner import RunnerOptions, run_steps
+from .sandbox import populate
+from .targets import BuildTarget, build_all
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(name)s: %(message)s",
-    handlers=[RichHandler(show_path=False)],
-)
 log = logging.getLogger("core")
 
 
+class _RichOnDemand(logging.Handler):
+    """
+    Hands records to a RichHandler, which (with rich) is only imported when
+    the first record is logged.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._handler: Optional[logging.Handler] = None
+
+    def emit(self, record: logging.LogRecord):
+        if self._handler is None:
+            from rich.logging import RichHandler
+
+            self._handler = RichHandler(show_path=False)
+            self._handler.setFormatter(self.formatter)
+        self._handler.emit(record)
+
+
+def setup_logging():
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format="%(name)s: %(message)s",
+        handlers=[_RichOnDemand()],
+    )
+
+
 def stop(reason: str) -> NoReturn:
     log.fatal(f"{reason}")
     exit(1)
@@ -42,20 +68,14 @@ def collect(targets: list[str]) -> list[str]:
 
 
 @contextlib.contextmanager
-def prepare_env(sources: list[str]):
+def prepare_env(sources: list[str], mode: str = "copy"):
     """
-    Copy files into a new, temporary directory.
+    Copy (or, depending on mode, link) files into a new, temporary directory.
     """
-    with TemporaryDirectory() as tmpdir:
+    with populate(sources, mode, cache_dir() / "sandbox") as tmpdir:
         log.debug(
             "Created temporary directory %s from %d sources", tmpdir, len(sources)
         )
-        for source in sources:
-            if os.path.isdir(source):
-                name = os.path.basename(source)
-                shutil.copytree(source, os.path.join(tmpdir, name))
-            else:
-                shutil.copy(source, tmpdir)
         yield tmpdir
 
 
@@ -84,64 +104,97 @@ def check_deps_simple(
 
 def check_deps_complex(
     plugin_list: list[PluginSpec], providers: dict[str, list[PluginSpec]]
-):
-    def check(
-        target: PluginSpec,
-        current: Optional[PluginSpec] = None,
-        visited: Optional[list[str]] = None,
-    ):
-        if visited is None:
-            visited = list()
-        if current is None:
-            current = target
-        if current.name in visited:
-            log.warning(
-                f"Plugins: while resolving '{current.name}' for '{target.name}': circular dependency "
-                f"{' -> '.join(visited)} -> {current.name}"
-            )
-            return False, {}
-        visited.append(current.name)
-
-        for slot in current.use:
-            valid_deps_from_here = set()
-            for i, provider in enumerate(providers[slot]):
-                if i > 0:
-                    log.info(
-                        f"attempt #{i + 1}: resolve '{slot}' dependency with '{provider.name}'"
-                    )
-                ok, extra = check(
-                    target=target, current=provider, visited=visited.copy()
-                )
-                if ok:
-                    valid_deps_from_here.add(provider.name)
-                    break
-            if len(valid_deps_from_here) == 0:
-                log.warning(
-                    f"Plugins: no plugin providing '{slot}' (used by {current.name}) "
-                    f"can resolve when starting with {target.name}"
-                )
-                return False, (
-                    f"\nall {len(providers[slot])} plugins providing '{slot}' "
-                    f"can't be resolved when starting with {target.name}"
-                )
-        return True, None
-
+) -> ResolveGraph:
+    graph = ResolveGraph(providers)
     for plugin in plugin_list:
-        check_ok, check_info = check(plugin)
-        if not check_ok:
-            stop(
-                f"Plugin dependency error: cannot satisfy requirements for '{plugin.name}': {check_info}"
-            )
-
-
-def run_cli() -> int:
-    conf_path = os.environ.get("ALTER_CONF", "alter.yaml")
-    if not os.path.exists(conf_path):
+        if graph.resolvable(plugin.name):
+            continue
+        problems = graph.explain(plugin)
         stop(
-            f"No configuration file found at {conf_path}. "
-            f"Set ALTER_CONF or create alter.toml in the working directory."
+            f"Plugin dependency error: cannot satisfy requirements for '{plugin.name}': "
+            + "".join(f"\n  {problem}" for problem in problems)
         )
-    conf = load_config(conf_path).data
+    log.info(
+        f"Plugin check second pass OK; {len(graph.plugins)} plugins resolved "
+        f"in {graph.elapsed:.4f}s"
+    )
+    return graph
+
+
+def parse_args(argv: Optional[list[str]]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="alterable",
+        description="Build the project described by $ALTER_CONF (alter.yaml).",
+    )
+    parser.add_argument(
+        "command",
+        nargs="?",
+        choices=["build", "watch"],
+        default="build",
+        help="build once (the default), or keep rebuilding as sources change",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=0.5,
+        metavar="SECONDS",
+        help="with watch, how often to check the sources for changes",
+    )
+    parser.add_argument(
+        "--trace",
+        type=Path,
+        metavar="OUT.json",
+        help="record how long each phase, plugin and file took, as Chrome "
+        "trace events (open in chrome://tracing or ui.perfetto.dev)",
+    )
+    parser.add_argument(
+        "--trace-top",
+        type=int,
+        default=10,
+        metavar="N",
+        help="with --trace, how many of the slowest spans to list",
+    )
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="show how long startup imports take instead of building",
+    )
+    parser.add_argument(
+        "--startup-budget",
+        type=float,
+        metavar="MS",
+        help="with --profile-startup, exit with status 1 above this many ms",
+    )
+    return parser.parse_args(argv)
+
+
+class Project:
+    """
+    Everything loaded from the configuration, with the plans resolved.
+    """
+
+    def __init__(
+        self,
+        *,
+        rules: list[str],
+        plugins: dict[str, PluginSpec],
+        options: RunnerOptions,
+        preprocess: Optional[list[DepLoadStruct]],
+        ordered: bool,
+        targets: list[BuildTarget],
+    ):
+        self.rules = rules
+        self.plugins = plugins
+        self.options = options
+        # None when there is no preprocessing
+        self.preprocess = preprocess
+        self.ordered = ordered
+        self.targets = targets
+
+
+def load_project(conf_path: str) -> Project:
+    with trace.tracer.span("load configuration", "phase"):
+        conf = load_config(conf_path)
 
     # Collect
     collect_conf = conf.get("collect", {})
@@ -152,15 +205,13 @@ def run_cli() -> int:
         stop(f"Invalid type: collect.rules should be list, is actually {type(rules)}")
     if len(rules) == 0:
         stop("No input rules specified (collect.rules is empty)")
-    sources = collect(rules)
-    log.info("%d sources", len(sources))
 
     raw_plugins = conf.get("plugins", {})
     if not isinstance(raw_plugins, dict):
         stop(f"Invalid type: 'plugins' should be a dict")
     plugins: list[PluginSpec] = [
         UserPluginSpec.load(k, v) for k, v in raw_plugins.items()
-    ] + list_builtins()
+    ] + list_builtins(conf.get("builtins", {}))
 
     # Collect a set of every slot needed at any point
     pre_conf = conf.get("preprocess", {})
@@ -176,37 +227,173 @@ def run_cli() -> int:
             )
         for slot in pre_conf["use"]:
             all_requirements[slot].append("'preprocess' action")
+    try:
+        targets = [
+            BuildTarget.load(name, target_conf)
+            for name, target_conf in conf.get("buildsystem", {}).items()
+        ]
+    except ValueError as e:
+        stop(f"Invalid type: {e}")
+    for target in targets:
+        for slot in target.use:
+            all_requirements[slot].append(f"'{target.name}' build target")
+    runner_conf = conf.get("runner", {})
+    try:
+        runner_options = RunnerOptions.load(runner_conf)
+    except ValueError as e:
+        stop(f"Invalid runner options: {e}")
+    with trace.tracer.span("resolve", "phase"):
+        return _resolve(
+            plugins, all_requirements, rules, pre_conf, targets, runner_options
+        )
+
+
+def _resolve(
+    plugins: list[PluginSpec],
+    all_requirements: dict[str, list[str]],
+    rules: list[str],
+    pre_conf: dict,
+    targets: list[BuildTarget],
+    runner_options: RunnerOptions,
+) -> Project:
     mapped_plugins = {p.name: p for p in plugins}
     available_slots, providers = check_deps_simple(plugins, all_requirements)
-    # check_deps_complex(plugins, providers)
-    log.info("%d plugins ready", len(raw_plugins))
-
-    with prepare_env(sources) as presrc:
-        tempdir = Path(presrc)
-        # Pre-process
-        if "use" not in pre_conf:
-            log.info("no pre-processing specified, skipping")
-        else:
-            log.debug("Pre-processing in %s", presrc)
-            pre_use = pre_conf["use"]
-            if not isinstance(pre_use, list):
-                stop(
-                    f"Invalid type: preprocess.use should be list, is actually {type(pre_use)}"
-                )
-            solve_ok, steps = solve_compute(
-                mapped_plugins, providers, "preprocess", pre_use
-            )
-            if not solve_ok:
-                stop("Preprocessing failed.")
-            try:
-                run_steps(tempdir, steps, mapped_plugins)
-            except Exception as e:
-                log.critical(
-                    f"Preprocessing [bold red]failed[/] because of [red][bold]{type(e).__name__}[/]: "
-                    f"[italic]{e}[/][/]",
-                    extra={"markup": True},
-                )
-                exit(1)
+    graph = check_deps_complex(plugins, providers)
+    log.info("%d plugins ready", len(plugins))
+
+    steps = None
+    if "use" in pre_conf:
+        solve_ok, steps = solve_compute(
+            mapped_plugins, providers, "preprocess", pre_conf["use"], graph
+        )
+        if not solve_ok:
+            stop("Preprocessing failed.")
+    for target in targets:
+        solve_ok, target.steps = solve_compute(
+            mapped_plugins, providers, target.name, target.use, graph
+        )
+        if not solve_ok:
+            stop(f"Build target '{target.name}' failed.")
+    return Project(
+        rules=rules,
+        plugins=mapped_plugins,
+        options=runner_options,
+        preprocess=steps,
+        ordered=pre_conf.get("ordered", True),
+        targets=targets,
+    )
+
+
+def preprocess(
+    project: Project,
+    sandbox: Path,
+    ctx: Optional[ProjectContext] = None,
+    only: Optional[set[Path]] = None,
+    written: Optional[set[Path]] = None,
+) -> bool:
+    """
+    Run the preprocessing plan in the sandbox. False if it failed. See
+    run_steps for only and written.
+    """
+    if project.preprocess is None:
+        log.info("no pre-processing specified, skipping")
+        return True
+    log.debug("Pre-processing in %s", sandbox)
+    try:
+        with trace.tracer.span("preprocess", "phase"):
+            _preprocess(project, sandbox, ctx, only, written)
+    except Exception as e:
+        log.critical(
+            f"Preprocessing [bold red]failed[/] because of [red][bold]{type(e).__name__}[/]: "
+            f"[italic]{e}[/][/]",
+            extra={"markup": True},
+        )
+        return False
+    return True
+
+
+def _preprocess(
+    project: Project,
+    sandbox: Path,
+    ctx: Optional[ProjectContext],
+    only: Optional[set[Path]],
+    written: Optional[set[Path]],
+):
+    manifest = None
+    if project.options.incremental and only is None:
+        manifest = BuildManifest.load(cache_dir(), "preprocess", sandbox)
+    run_steps(
+        sandbox,
+        project.preprocess,
+        project.plugins,
+        project.options,
+        ordered=project.ordered,
+        manifest=manifest,
+        ctx=ctx,
+        only=only,
+        written=written,
+    )
+    if manifest is not None:
+        prune_objects(cache_dir())
+
+
+def build(project: Project, sandbox: Path) -> bool:
+    """
+    Build every target from the preprocessed sandbox. False if any failed.
+    """
+    if len(project.targets) == 0:
+        log.info("no build targets specified, done")
+        return True
+    failed = build_all(project.targets, str(sandbox), project.plugins, project.options)
+    if failed:
+        log.critical(f"{len(failed)} of {len(project.targets)} build targets failed")
+    return not failed
+
+
+def run_cli(argv: Optional[list[str]] = None) -> int:
+    args = parse_args(argv)
+    if args.profile_startup:
+        from .startup import profile_startup
+
+        return profile_startup(args.startup_budget)
+    setup_logging()
+    conf_path = os.environ.get("ALTER_CONF", "alter.yaml")
+    if not os.path.exists(conf_path):
+        stop(
+            f"No configuration file found at {conf_path}. "
+            f"Set ALTER_CONF or create alter.toml in the working directory."
+        )
+    if args.trace is not None:
+        tracer = trace.start_tracing()
+    try:
+        return _run(args, conf_path)
+    finally:
+        if args.trace is not None:
+            tracer.export(args.trace)
+            tracer.summary(args.trace_top)
+            log.info(f"trace written to {args.trace}")
+
+
+def _run(args: argparse.Namespace, conf_path: str) -> int:
+    project = load_project(conf_path)
+    # the configuration is good: remember that it was validated
+    configcache.save()
+    if args.command == "watch":
+        from .watch import watch
+
+        return watch(project, args.interval)
+
+    with trace.tracer.span("collect", "phase"):
+        sources = collect(project.rules)
+    log.info("%d sources", len(sources))
+    with contextlib.ExitStack() as stack:
+        with trace.tracer.span("prepare sandbox", "phase"):
+            presrc = stack.enter_context(prepare_env(sources, project.options.sandbox))
+        if not preprocess(project, Path(presrc)):
+            return 1
+        with trace.tracer.span("build", "phase"):
+            if not build(project, Path(presrc)):
+                return 1
     return 0
 
 
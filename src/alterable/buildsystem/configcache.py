@@ -0,0 +1,86 @@
+"""
+Validated configurations, cached in the cache directory. A configuration file
+whose contents haven't changed since it was last validated is loaded from the
+cache without importing strictyaml at all; anything else goes through
+configloader (and its detailed error messages) as usual.
+
+Newly validated configurations are only written to the cache by save(), once
+a build is about to run, so that failed or aborted runs leave no trace.
+"""
+
+import json
+import logging
+import os
+import tempfile
+from hashlib import sha256
+from os import PathLike
+from pathlib import Path
+from typing import Any, Optional
+
+from ..util import cache_dir
+
+log = logging.getLogger("core.configcache")
+
+# the modules that decide what a configuration validates to
+_SCHEMA_SOURCES = [
+    Path(__file__).with_name("configloader.py"),
+    Path(__file__).with_name("modes.py"),
+    Path(__file__).parent.parent / "plugins" / "structure.py",
+]
+_fingerprint: Optional[bytes] = None
+# cache file -> entry, validated during this run but not written yet
+_unsaved: dict[Path, dict[str, Any]] = {}
+
+
+def schema_fingerprint() -> bytes:
+    """
+    Hash of the schema's source, so that any change to it (or an upgrade)
+    makes cached configurations stale.
+    """
+    global _fingerprint
+    if _fingerprint is None:
+        digest = sha256()
+        for source in _SCHEMA_SOURCES:
+            digest.update(source.read_bytes())
+        _fingerprint = digest.digest()
+    return _fingerprint
+
+
+def load_data(conf_path: PathLike) -> dict[str, Any]:
+    with open(conf_path, "rb") as f:
+        key = sha256(schema_fingerprint() + f.read()).hexdigest()
+    name = sha256(os.path.realpath(conf_path).encode()).hexdigest()[:16]
+    cached = cache_dir() / "config" / f"{name}.json"
+    try:
+        with open(cached) as f:
+            entry = json.load(f)
+        if entry.get("key") == key:
+            log.debug("configuration unchanged, using the validated copy")
+            return entry["data"]
+    except FileNotFoundError:
+        pass
+    except (ValueError, KeyError) as e:
+        log.debug(f"ignoring unreadable configuration cache {cached}: {e}")
+
+    from .configloader import load
+
+    data = load(conf_path).data
+    _unsaved[cached] = {"key": key, "data": data}
+    return data
+
+
+def save():
+    """
+    Write the configurations validated since the last call to the cache.
+    """
+    while _unsaved:
+        cached, entry = _unsaved.popitem()
+        try:
+            cached.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                "w", dir=cached.parent, suffix=".json", delete=False
+            ) as tmp:
+                json.dump(entry, tmp)
+            os.replace(tmp.name, cached)
+        except OSError as e:
+            log.debug(f"couldn't cache the validated configuration: {e}")
@@ -3,8 +3,6 @@ import re
 import textwrap
 from os import PathLike
 
-import rich
-from rich.markup import escape
 from strictyaml import (
     YAML,
     Any,
@@ -29,6 +27,7 @@ from strictyaml.yamllocation import YAMLChunk
 from alterable.plugins.structure import PluginData
 
 from ..util import mk_stop
+from .modes import FLUSH_MODES, OUTPUT_MODES, SANDBOX_MODES
 
 log = logging.getLogger("core.configloader")
 stop = mk_stop(log)
@@ -50,7 +49,10 @@ class _PipelineValidator(MapValidator):
         "target": Enum(PluginData.PIPELINE_TARGET_VALID),
         "entrypoint": Str(),
     }
-    OPTIONALS: dict[str, Validator] = {Optional("match"): Any()}
+    OPTIONALS: dict[str, Validator] = {
+        Optional("match"): Any(),
+        Optional("chunk"): Any(),
+    }
 
     def __init__(self):
         pass
@@ -60,21 +62,19 @@ class _PipelineValidator(MapValidator):
         global err_ctx
         context = []
         err_ctx.append(context)
-        # this better not be stateful
-        Map(_PipelineValidator.BASE_VALIDATOR | _PipelineValidator.OPTIONALS).validate(
-            chunk
-        )
-        mode: str | None = None
-        mapping = chunk.expect_mapping()
-        stringify = Str()
-        for k, v in mapping:
-            yaml_key = stringify(k)
-            if yaml_key == PluginData.PIPELINE_TARGET:
-                mode = stringify(v).data
-                if mode not in PluginData.PIPELINE_TARGET_VALID:  # sanity check
-                    stop(f"Invalid pipeline target: {mode!r}")
-        assert mode in PluginData.PIPELINE_TARGET_VALID, "Invalid pipeline target"
-        rules = PluginData.RULES[mode]
+        # Peek at the target in the raw data, so that valid pipelines are only
+        # validated once (by the combined validator below)
+        contents = chunk.contents
+        mode = None
+        if isinstance(contents, dict):
+            mode = contents.get(PluginData.PIPELINE_TARGET)
+        if mode not in PluginData.PIPELINE_TARGET_VALID:
+            # this better not be stateful
+            Map(
+                _PipelineValidator.BASE_VALIDATOR | _PipelineValidator.OPTIONALS
+            ).validate(chunk)
+            stop(f"Invalid pipeline target: {mode!r}")  # sanity check
+        rules = PluginData.rules(mode)
         if len(rules) == 0:
             context.append(
                 f"info: Pipeline target {mode!r} requires no additional properties"
@@ -99,6 +99,16 @@ def _deps(*, default_ordered: bool):
     }
 
 
+def _runner():
+    return {
+        Optional("executor"): Enum(PluginData.EXECUTORS),
+        Optional("workers"): Int(),
+        Optional("incremental"): Bool(),
+        # async entrypoints: calls awaited at once
+        Optional("concurrency"): Int(),
+    }
+
+
 schema = Map(
     {
         "collect": Map(
@@ -107,6 +117,26 @@ schema = Map(
             }
         ),
         Optional("preprocess"): EmptyDict() | Map(_deps(default_ordered=True)),
+        Optional("runner"): EmptyDict()
+        | Map(
+            _runner()
+            | {
+                Optional("max_pending"): Int(),
+                Optional("steps"): Int(),
+                # 'hardlink' makes the sources read-only while a sandbox
+                # links to them; 'auto' only tries reflinks
+                Optional("sandbox"): Enum(SANDBOX_MODES),
+                # MiB
+                Optional("memory_budget"): Int(),
+                Optional("flush"): Enum(FLUSH_MODES),
+                # MiB
+                Optional("write_buffer"): Int(),
+                Optional("output"): Enum(OUTPUT_MODES),
+            }
+        ),
+        # options for builtin plugins, by name (e.g. parse_html)
+        Optional("builtins"): EmptyDict()
+        | MapPattern(Str(), EmptyDict() | MapPattern(Str(), Str())),
         Optional("buildsystem"): EmptyDict()
         | MapPattern(
             Str(),
@@ -114,6 +144,8 @@ schema = Map(
                 _deps(default_ordered=True)
                 | {
                     Optional("exclude"): _patterns(True),
+                    # defaults to build/<target name>
+                    Optional("output"): Str(),
                 }
             ),
         ),
@@ -127,6 +159,7 @@ schema = Map(
                     "path": Str(),
                     Optional("priority", default=0): Int(),
                     "pipeline": _PipelineValidator(),
+                    Optional("runner"): EmptyDict() | Map(_runner()),
                 }
             ),
         ),
@@ -140,6 +173,9 @@ def load(conf_path: PathLike) -> YAML:
     try:
         package = load_yaml(data, schema)
     except MarkedYAMLError as detail_e:
+        import rich
+        from rich.markup import escape
+
         context = []
         if detail_e.problem == "found a blank string":
             err_ctx.append(
@@ -0,0 +1,201 @@
+"""
+Incremental builds. The manifest remembers, for every step and file, the hash
+of the file before the step ran and the hash after. Outputs are kept in a
+content-addressed object store so unchanged files can be restored instead of
+processed again.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+from ..plugins.structure import PluginSpec, PreloadPluginSpec, UserPluginSpec
+from .store import ObjectStore, hash_file
+
+log = logging.getLogger("incremental")
+
+# [hash before, hash after]; 'after' is None when the step deleted the file
+EntryT = list[Optional[str]]
+
+
+def plugin_identity(plug: PluginSpec) -> str:
+    """
+    Hash of everything that can change what a plugin does: its name, pipeline
+    configuration and source file.
+    """
+    digest = hashlib.sha256()
+    digest.update(plug.name.encode())
+    digest.update(repr(sorted(vars(plug.pipeline).items())).encode())
+    source: Optional[str] = None
+    if isinstance(plug, UserPluginSpec):
+        source = plug.path
+    elif isinstance(plug, PreloadPluginSpec):
+        source = plug.source()
+    if source is not None:
+        source_hash = hash_file(Path(source))
+        digest.update((source_hash or "missing").encode())
+    return digest.hexdigest()
+
+
+class StepRecord:
+    """
+    Bookkeeping for one file step: which bindings were skipped and which
+    outputs need to be recorded once the step is done.
+    """
+
+    def __init__(self, manifest: "BuildManifest", plug: PluginSpec):
+        self.manifest = manifest
+        self.key = plugin_identity(plug)
+        self.name = plug.name
+        self.previous = manifest.previous_steps.get(self.key, {})
+        self.entries: dict[str, EntryT] = manifest.steps.setdefault(self.key, {})
+        self.pending: list[tuple[str, Path, Optional[str]]] = []
+        self.skipped = 0
+
+    def wanted(self, path: Path) -> bool:
+        """
+        Whether the step has to run on path. Files it already processed
+        get their previous output back instead.
+        """
+        rel = self.manifest.relative(path)
+        before = hash_file(path)
+        entry = self.previous.get(rel)
+        if (
+            before is not None
+            and entry is not None
+            and entry[0] == before
+            and (entry[1] == before or self.manifest.restore(entry[1], path))
+        ):
+            self.entries[rel] = entry
+            self.skipped += 1
+            return False
+        self.pending.append((rel, path, before))
+        return True
+
+    def record(self):
+        for rel, path, before in self.pending:
+            if before is None:
+                continue
+            after = hash_file(path)
+            if after is not None and after != before:
+                self.manifest.store(path, after)
+            self.entries[rel] = [before, after]
+        self.pending.clear()
+        if self.skipped > 0:
+            log.info(
+                f"[bright_blue]{self.name}[/]: {self.skipped} unchanged files reused",
+                extra={"markup": True},
+            )
+
+
+class BuildManifest:
+    """
+    Persistent record of the last successful run, one file per scope
+    (e.g. 'preprocess') inside the cache directory.
+    """
+
+    VERSION = 1
+
+    def __init__(self, root: Path, scope: str, sandbox: Path):
+        self.root = root
+        self.objects = ObjectStore(root / "objects")
+        self.path = root / f"manifest-{scope}.json"
+        self.sandbox = sandbox.absolute()
+        self.previous_sources: dict[str, str] = {}
+        self.previous_steps: dict[str, dict[str, EntryT]] = {}
+        self.sources: dict[str, str] = {}
+        self.steps: dict[str, dict[str, EntryT]] = {}
+        self.changed: Optional[set[Path]] = None
+
+    @classmethod
+    def load(cls, root: Path, scope: str, sandbox: Path):
+        manifest = cls(root, scope, sandbox)
+        try:
+            with open(manifest.path) as f:
+                data = json.load(f)
+            if data.get("version") == cls.VERSION:
+                manifest.previous_sources = data["sources"]
+                manifest.previous_steps = data["steps"]
+        except FileNotFoundError:
+            log.debug("no build manifest at %s, building everything", manifest.path)
+        except (ValueError, KeyError) as e:
+            log.warning(f"ignoring unreadable build manifest {manifest.path}: {e}")
+        manifest.scan_sources()
+        return manifest
+
+    def relative(self, path: Path) -> str:
+        return path.absolute().relative_to(self.sandbox).as_posix()
+
+    def scan_sources(self):
+        """
+        Hash the sandbox as it is before any plugin runs, and work out which
+        files were added, changed or removed since the last run.
+        """
+        for dir_path, _, filenames in os.walk(self.sandbox):
+            for file in filenames:
+                full_path = Path(dir_path) / file
+                digest = hash_file(full_path)
+                if digest is not None:
+                    self.sources[self.relative(full_path)] = digest
+        names = self.sources.keys() | self.previous_sources.keys()
+        self.changed = {
+            self.sandbox / name
+            for name in names
+            if self.sources.get(name) != self.previous_sources.get(name)
+        }
+        log.info(
+            f"{len(self.changed)} of {len(self.sources)} sources changed since the last run"
+        )
+
+    def step(self, plug: PluginSpec) -> StepRecord:
+        return StepRecord(self, plug)
+
+    def store(self, path: Path, digest: str):
+        self.objects.add(path, digest)
+
+    def restore(self, digest: Optional[str], path: Path) -> bool:
+        """
+        Put a recorded output back in place. False if it isn't available.
+        """
+        if digest is None:
+            path.unlink(missing_ok=True)
+            return True
+        if hash_file(path) == digest:
+            return True
+        stored = self.objects.path(digest)
+        if not stored.exists():
+            return False
+        shutil.copyfile(stored, path)
+        return True
+
+    def save(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        data = {"version": self.VERSION, "sources": self.sources, "steps": self.steps}
+        with tempfile.NamedTemporaryFile(
+            "w", dir=self.root, suffix=".json", delete=False
+        ) as tmp:
+            json.dump(data, tmp)
+        os.replace(tmp.name, self.path)
+
+
+def prune_objects(root: Path):
+    """
+    Remove stored outputs that no manifest in root refers to. Call it once
+    nothing else is building: build targets share the store from separate
+    processes, and objects they are adding aren't referenced yet.
+    """
+    referenced: set[str] = set()
+    for other in root.glob("manifest-*.json"):
+        try:
+            with open(other) as f:
+                steps = json.load(f).get("steps", {})
+        except ValueError:
+            continue
+        for entries in steps.values():
+            referenced.update(entry[1] for entry in entries.values() if entry[1])
+    ObjectStore(root / "objects").prune(referenced)
@@ -0,0 +1,11 @@
+"""
+Values the 'runner' options accept, shared by the config loader and the code
+that uses them.
+"""
+
+# how the sandbox is populated (see sandbox.py)
+SANDBOX_MODES = ["copy", "reflink", "hardlink", "auto"]
+# when written files are saved
+FLUSH_MODES = ["step", "end"]
+# how build targets are exported
+OUTPUT_MODES = ["copy", "store"]
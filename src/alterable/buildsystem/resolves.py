@@ -1,7 +1,9 @@
 # it RESOLVES dependencies.
+import itertools
 import logging
 import time
-from typing import NamedTuple, TypeAlias
+from collections import defaultdict, deque
+from typing import NamedTuple, Optional, TypeAlias
 
 from ..plugins.structure import PluginPipelineInfo, PluginSpec
 
@@ -14,45 +16,304 @@ class DependencyResolutionError(RuntimeError):
     pass
 
 
+class _Frame:
+    """
+    A plugin being resolved by ResolveGraph._choose.
+    """
+
+    def __init__(self, plugin: PluginSpec, slots: list[str]):
+        self.plugin = plugin
+        self.slots = slots
+        self.slot = 0
+        self.candidate = 0
+        self.chosen: dict[str, str] = {}
+        # depth of the deepest frame that ruled out a candidate, or -1
+        self.blocked = -1
+
+
+class ResolveGraph:
+    """
+    Memoized slot -> provider graph.
+
+    A plugin can be resolved once every slot it uses has at least one provider
+    that can be resolved. Solving this by propagation (like unit propagation in
+    Horn-SAT) visits every plugin and slot edge once, instead of backtracking
+    through every combination of providers.
+
+    Among the resolvable providers of a slot, the one declared last is used,
+    unless that would close a cycle: then the next one back is tried, and so
+    on. Finished sub-plans are shared, and a provider that can't be used
+    because of the plugins being resolved around it is remembered as long as
+    they are.
+    """
+
+    def __init__(self, providers: dict[str, list[PluginSpec]]):
+        self.providers = providers
+        self.plugins: dict[str, PluginSpec] = {}
+        for candidates in providers.values():
+            for plugin in candidates:
+                self.plugins.setdefault(plugin.name, plugin)
+        self.order: dict[str, int] = {}
+        self.choices: dict[str, dict[str, str]] = {}
+        self._stacks: dict[str, StacksType] = {}
+        self._candidate_cache: dict[str, list[str]] = {}
+        self.edges = 0
+        start = time.perf_counter()
+        self._propagate()
+        self.elapsed = time.perf_counter() - start
+
+    def _propagate(self):
+        unmet: dict[str, int] = {}
+        users: defaultdict[str, list[str]] = defaultdict(list)
+        queue: deque[str] = deque()
+        for name, plugin in self.plugins.items():
+            slots = set(plugin.use)
+            unmet[name] = len(slots)
+            for slot in slots:
+                users[slot].append(name)
+            if len(slots) == 0:
+                queue.append(name)
+        filled: set[str] = set()
+        while queue:
+            name = queue.popleft()
+            self.order[name] = len(self.order)
+            for slot in self.plugins[name].provides:
+                if slot in filled:
+                    continue
+                filled.add(slot)
+                for user in users[slot]:
+                    self.edges += 1
+                    unmet[user] -= 1
+                    if unmet[user] == 0:
+                        queue.append(user)
+
+    def _candidates(self, slot: str) -> list[str]:
+        if slot not in self._candidate_cache:
+            self._candidate_cache[slot] = [
+                provider.name
+                for provider in reversed(self.providers.get(slot, []))
+                if provider.name in self.order
+            ]
+        return self._candidate_cache[slot]
+
+    def _choose(self, target: PluginSpec) -> Optional[dict[str, str]]:
+        """
+        Providers for target's slots, choosing (and remembering) the providers'
+        own choices on the way. Depth first, without recursing, so that deep
+        chains don't hit the recursion limit.
+        """
+        # name -> (depth, frame serial) of the deepest plugin being resolved
+        # that made it unusable
+        failed: dict[str, tuple[int, int]] = {}
+        serials: list[int] = []
+        counter = itertools.count()
+        active: dict[str, int] = {}
+        frames: list[_Frame] = []
+
+        def push(plugin: PluginSpec):
+            active[plugin.name] = len(frames)
+            serials.append(next(counter))
+            frames.append(_Frame(plugin, list(dict.fromkeys(plugin.use))))
+
+        def blocker(name: str) -> int:
+            """
+            Depth of the frame that makes name unusable right now, or -1.
+            """
+            if name in active:
+                return active[name]
+            if name in failed:
+                depth, serial = failed[name]
+                if depth < 0:
+                    return 0  # for good
+                if depth < len(frames) and serials[depth] == serial:
+                    return depth
+            return -1
+
+        push(target)
+        result: Optional[dict[str, str]] = None
+        while frames:
+            frame = frames[-1]
+            waiting = False
+            while frame.slot < len(frame.slots):
+                candidates = self._candidates(frame.slots[frame.slot])
+                while frame.candidate < len(candidates):
+                    name = candidates[frame.candidate]
+                    if name in self.choices:
+                        break
+                    depth = blocker(name)
+                    if depth < 0:
+                        push(self.plugins[name])
+                        waiting = True
+                        break
+                    frame.blocked = max(frame.blocked, depth)
+                    frame.candidate += 1
+                if waiting:
+                    break
+                if frame.candidate == len(candidates):
+                    break
+                frame.chosen[frame.slots[frame.slot]] = candidates[frame.candidate]
+                frame.slot += 1
+                frame.candidate = 0
+            if waiting:
+                continue
+            frames.pop()
+            serials.pop()
+            del active[frame.plugin.name]
+            done = frame.slot == len(frame.slots)
+            if done:
+                result = frame.chosen
+                if frame.plugin.name in self.plugins:
+                    self.choices[frame.plugin.name] = frame.chosen
+            else:
+                result = None
+                blocked = min(frame.blocked, len(frames) - 1)
+                failed[frame.plugin.name] = (
+                    blocked,
+                    serials[blocked] if blocked >= 0 else -1,
+                )
+                if frames:
+                    parent = frames[-1]
+                    parent.blocked = max(parent.blocked, blocked)
+                    parent.candidate += 1
+        return result
+
+    def resolvable(self, name: str) -> bool:
+        return name in self.order
+
+    def solve(self, target: PluginSpec) -> Optional[StacksType]:
+        """
+        Plan for target, or None if it can't be resolved. target doesn't need
+        to be part of the graph (the anonymous 'preprocess' plugin isn't).
+        """
+        if target.name in self.choices:
+            chosen = self.choices[target.name]
+        else:
+            chosen = self._choose(target)
+        if chosen is None:
+            return None
+        # Build shared sub-plans bottom-up so deep chains don't recurse.
+        needed: list[str] = []
+        pending = list(chosen.values())
+        while pending:
+            name = pending[-1]
+            if name in self._stacks:
+                pending.pop()
+                continue
+            missing = [
+                provider
+                for provider in self.choices[name].values()
+                if provider not in self._stacks
+            ]
+            if missing:
+                pending.extend(missing)
+                continue
+            pending.pop()
+            self._stacks[name] = {
+                slot: (provider, self._stacks[provider])
+                for slot, provider in self.choices[name].items()
+            }
+        return {slot: (name, self._stacks[name]) for slot, name in chosen.items()}
+
+    def explain(self, target: PluginSpec) -> list[str]:
+        """
+        Reasons why target can't be resolved: slots nobody provides, and cycles
+        (strongly connected components) among the unresolvable plugins it needs.
+        """
+        problems: list[str] = []
+        edges: dict[str, list[str]] = {}
+        pending = [target]
+        while pending:
+            plugin = pending.pop()
+            if plugin.name in edges:
+                continue
+            edges[plugin.name] = []
+            for slot in plugin.use:
+                candidates = self.providers.get(slot, [])
+                if len(candidates) == 0:
+                    problems.append(
+                        f"nothing provides '{slot}' (used by {plugin.name})"
+                    )
+                    continue
+                if any(self.resolvable(p.name) for p in candidates):
+                    continue
+                for provider in candidates:
+                    edges[plugin.name].append(provider.name)
+                    pending.append(provider)
+        for component in _strongly_connected(edges):
+            if len(component) > 1 or component[0] in edges[component[0]]:
+                problems.append(
+                    f"circular dependency between {', '.join(sorted(component))}"
+                )
+        return problems
+
+
+def _strongly_connected(edges: dict[str, list[str]]) -> list[list[str]]:
+    """
+    Tarjan's algorithm, iterative.
+    """
+    index: dict[str, int] = {}
+    low: dict[str, int] = {}
+    on_stack: set[str] = set()
+    stack: list[str] = []
+    components: list[list[str]] = []
+    for root in edges:
+        if root in index:
+            continue
+        work = [(root, 0)]
+        while work:
+            node, i = work.pop()
+            if i == 0:
+                index[node] = low[node] = len(index)
+                stack.append(node)
+                on_stack.add(node)
+            recurse = False
+            children = edges.get(node, [])
+            while i < len(children):
+                child = children[i]
+                i += 1
+                if child not in index:
+                    work.append((node, i))
+                    work.append((child, 0))
+                    recurse = True
+                    break
+                if child in on_stack:
+                    low[node] = min(low[node], index[child])
+            if recurse:
+                continue
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+            if low[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(component)
+    return components
+
+
 def compute_plugin(
-    target: PluginSpec, providers: dict[str, list[PluginSpec]]
+    target: PluginSpec,
+    providers: dict[str, list[PluginSpec]],
+    graph: Optional[ResolveGraph] = None,
 ) -> tuple[bool, StacksType]:
-    attempts = 0
     start = time.perf_counter()
-
-    def _helper(at: PluginSpec, visited: list[str]) -> tuple[bool, StacksType]:
-        nonlocal attempts
-        if at.name in visited:
-            return False, {}
-        visited.append(at.name)
-        stacks: StacksType = {}
-
-        for requirement in at.use:
-            usable_dependencies: list[PluginSpec] = []
-            for provider in providers[requirement]:
-                valid, stack_ = _helper(provider, visited.copy())
-                attempts += 1
-                if valid:
-                    stacks[requirement] = (provider.name, stack_)
-                    usable_dependencies.append(provider)
-            if len(usable_dependencies) == 0:
-                # log.debug("none of the providers for %s are usable", requirement)
-                return False, {}
-
-        return True, stacks.copy()
-
-    result = _helper(target, [])
+    graph = graph or ResolveGraph(providers)
+    result = graph.solve(target)
     end = time.perf_counter()
-    if result[0]:
+    if result is not None:
         log.info(
-            f"plan created for {target.name}, {attempts} tries in {end - start:.4f}s"
-        )
-    else:
-        log.error(
-            f"failed to make dependency plan for {target.name}, {attempts} tries in {end - start:.4f}s"
+            f"plan created for {target.name}, {len(graph.plugins)} plugins / "
+            f"{graph.edges} edges in {end - start:.4f}s"
         )
-        return result
-    return result
+        return True, result
+    log.error(f"failed to make dependency plan for {target.name} in {end - start:.4f}s")
+    for problem in graph.explain(target):
+        log.error(f"  {problem}")
+    return False, {}
 
 
 class DepLoadStruct(NamedTuple):
@@ -60,42 +321,56 @@ class DepLoadStruct(NamedTuple):
     load_after: set[str] = set()
 
 
-# WIP TODO
 def compute_load_order(
     plugins: dict[str, PluginSpec], stacks: StacksType
 ) -> list[DepLoadStruct]:
     loaders: dict[str, DepLoadStruct] = {}
-    load_order: list[DepLoadStruct] = []
-
-    def _traverse(substack: StacksType):
-        for slot_name, solution in substack.items():
-            if solution[0] not in loaders:
-                loaders[solution[0]] = DepLoadStruct(solution[0], set())
-            loaders[solution[0]].load_after.update(
-                map(lambda x: x[0], solution[1].values())
-            )
-            # for k2, v2 in solution[1].items():
-            _traverse(solution[1])
-
-    _traverse(stacks)
-    remaining = len(loaders)
-    loaded = set()
-
-    MAX_TRIES = 1000
-    tries = 0
-    while remaining > 0:
-        tries += 1
-        if tries > MAX_TRIES:
-            raise DependencyResolutionError(
-                f"Failed to resolve load order in a reasonable amount of time. {remaining} left, {len(loaded)} loaded."
-            )
-        for name, loader in loaders.items():
-            if name in loaded:
-                continue
-            if len(loader.load_after - loaded) == 0:
-                load_order.append(loader)
-                loaded.add(name)
-                remaining -= 1
+
+    # Sub-plans are shared between plugins, so only walk each one once. The
+    # walk is depth first, in slot order, which decides between steps that
+    # could run in either order.
+    pending = list(reversed(stacks.items()))
+    seen: set[int] = set()
+    while pending:
+        slot_name, solution = pending.pop()
+        if solution[0] not in loaders:
+            loaders[solution[0]] = DepLoadStruct(solution[0], set())
+        loaders[solution[0]].load_after.update(
+            map(lambda x: x[0], solution[1].values())
+        )
+        if id(solution[1]) not in seen:
+            seen.add(id(solution[1]))
+            pending.extend(reversed(solution[1].items()))
+
+    # Load order: sweep over the plugins in the order they were found, again
+    # and again, loading each one whose dependencies are loaded. Rather than
+    # sweeping, work out the sweep (and position in it) each one would load
+    # in, taking the plugins in Kahn's algorithm order.
+    position = {name: i for i, name in enumerate(loaders)}
+    waiting = {name: len(loader.load_after) for name, loader in loaders.items()}
+    dependents: defaultdict[str, list[str]] = defaultdict(list)
+    for name, loader in loaders.items():
+        for dependency in loader.load_after:
+            dependents[dependency].append(name)
+    sweep = {name: 0 for name in loaders}
+    queue = deque(name for name, count in waiting.items() if count == 0)
+    loaded: list[str] = []
+    while queue:
+        name = queue.popleft()
+        loaded.append(name)
+        for dependent in dependents[name]:
+            after = sweep[name] + (position[name] > position[dependent])
+            sweep[dependent] = max(sweep[dependent], after)
+            waiting[dependent] -= 1
+            if waiting[dependent] == 0:
+                queue.append(dependent)
+    loaded.sort(key=lambda name: (sweep[name], position[name]))
+    load_order = [loaders[name] for name in loaded]
+    if len(load_order) != len(loaders):
+        stuck = [name for name, count in waiting.items() if count > 0]
+        raise DependencyResolutionError(
+            f"Circular load order between {', '.join(sorted(stuck))}"
+        )
     log.info(" then ".join(map(lambda x: f"'{x.name}'", load_order)))
     return load_order
 
@@ -105,6 +380,7 @@ def compute(
     providers: dict[str, list[PluginSpec]],
     reason: str,
     requirements: list[str],
+    graph: Optional[ResolveGraph] = None,
 ) -> tuple[bool, list[DepLoadStruct]]:
     anon = PluginSpec(
         name=f"({reason} requirements: {', '.join(requirements)})",
@@ -112,7 +388,7 @@ def compute(
         provides=set(),
         use=requirements,
     )
-    ok, result = compute_plugin(anon, providers)
+    ok, result = compute_plugin(anon, providers, graph)
     if not ok:
         return False, []
     # log.info(result)
@@ -1,24 +1,652 @@
+import concurrent.futures as futures
+import contextlib
+import functools
+import heapq
+import inspect
 import logging
+import os
+import threading
+import time
+from collections import defaultdict
 from pathlib import Path
+from typing import Any, Awaitable, Callable, Coroutine, Iterable, Optional
 
-from ..plugins.prepare import prepare
-from ..plugins.shared_context import ProjectContext
-from ..plugins.structure import PluginSpec
-from .resolves import DepLoadStruct
+from ..plugins.matcher import compile_rules
+from ..plugins.prepare import SelectT, prepare, split_batch
+from ..plugins.shared_context import FileContext, ProjectContext
+from ..plugins.structure import (
+    BatchPluginPipelineInfo,
+    FilePluginPipelineInfo,
+    PluginData,
+    PluginSpec,
+    ProjectPluginPipelineInfo,
+)
+from ..plugins.transfer import FileState, SharedBytes, share_tracker
+from ..util import format_size
+from . import trace
+from .incremental import BuildManifest, StepRecord
+from .modes import FLUSH_MODES, OUTPUT_MODES, SANDBOX_MODES
+from .resolves import DependencyResolutionError, DepLoadStruct
 
 log = logging.getLogger("runner")
 
 
-def run_steps(
-    sandbox: Path, actions: list[DepLoadStruct], plugins: dict[str, PluginSpec]
+# MiB
+DEFAULT_MEMORY_BUDGET = 512
+
+
+def _mib(value: Optional[int]) -> Optional[int]:
+    return value * 1024 * 1024 if value is not None else None
+
+
+class RunnerOptions:
+    """
+    Global execution options, from the 'runner' section of the configuration.
+    """
+
+    def __init__(
+        self,
+        *,
+        executor: str = "serial",
+        workers: Optional[int] = None,
+        max_pending: Optional[int] = None,
+        steps: Optional[int] = None,
+        incremental: bool = False,
+        sandbox: str = "copy",
+        memory_budget: Optional[int] = None,
+        flush: str = "step",
+        write_buffer: Optional[int] = None,
+        output: str = "copy",
+        concurrency: Optional[int] = None,
+    ):
+        self.executor = executor
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 2
+        # steps run at once; a serial run keeps them on the calling thread
+        self.steps = steps or (1 if executor == "serial" else self.workers)
+        self.incremental = incremental
+        self.sandbox = sandbox
+        # bytes of cached file properties kept in memory; file contents are
+        # cached too, so there is always a limit
+        self.memory_budget = memory_budget or _mib(DEFAULT_MEMORY_BUDGET)
+        # when written files are saved: after every step, or only at the end
+        # of the run (and whenever more than write_buffer bytes are pending)
+        self.flush = flush
+        self.write_buffer = write_buffer
+        # how build targets are exported: plain copies, or deduplicated
+        # through a content-addressed store
+        self.output = output
+        # how many calls of an async entrypoint are awaited at once, unless
+        # the plugin sets its own limit
+        self.concurrency = concurrency or 32
+
+    @classmethod
+    def load(cls, template: dict):
+        executor = template.get("executor", "serial")
+        if executor not in PluginData.EXECUTORS:
+            raise ValueError(f"unknown executor: {executor}")
+        if template.get("sandbox", "copy") not in SANDBOX_MODES:
+            raise ValueError(f"unknown sandbox mode: {template['sandbox']}")
+        if template.get("flush", "step") not in FLUSH_MODES:
+            raise ValueError(f"unknown flush mode: {template['flush']}")
+        if template.get("output", "copy") not in OUTPUT_MODES:
+            raise ValueError(f"unknown output mode: {template['output']}")
+        for key in (
+            "workers",
+            "max_pending",
+            "steps",
+            "memory_budget",
+            "write_buffer",
+            "concurrency",
+        ):
+            value = template.get(key)
+            if value is not None and value < 1:
+                raise ValueError(f"runner.{key} must be at least 1 (got {value})")
+        return cls(
+            executor=executor,
+            workers=template.get("workers"),
+            max_pending=template.get("max_pending"),
+            steps=template.get("steps"),
+            incremental=template.get("incremental", False),
+            sandbox=template.get("sandbox", "copy"),
+            memory_budget=_mib(template.get("memory_budget")),
+            flush=template.get("flush", "step"),
+            write_buffer=_mib(template.get("write_buffer")),
+            output=template.get("output", "copy"),
+            concurrency=template.get("concurrency"),
+        )
+
+    def for_plugin(
+        self, plug: PluginSpec, asynchronous: bool = False
+    ) -> tuple[str, int]:
+        """
+        Executor kind and worker count to use for a plugin's bindings.
+        Async entrypoints run on the event loop ("async"), with the
+        concurrency limit as the worker count. Only file and batch targets
+        produce more than one binding, so everything else runs serially.
+        """
+        if asynchronous:
+            return "async", plug.runner.concurrency or self.concurrency
+        if not isinstance(plug.pipeline, FilePluginPipelineInfo):
+            return "serial", 1
+        return (
+            plug.runner.executor or self.executor,
+            plug.runner.workers or self.workers,
+        )
+
+
+def _run_in_worker(plug: PluginSpec, *states: FileState) -> list[FileState]:
+    """
+    Process pool entry: one state for file targets, a chunk of them for
+    batches. The worker loads the plugin itself (cached after the first
+    binding), runs it on contexts restored from the parent's, and sends them
+    back without saving anything; the parent merges and saves them, along
+    with the values the worker computed (except local ones).
+    """
+    module = plug.resolve()
+    entrypoint = getattr(module, plug.pipeline.entrypoint)
+    contexts = [FileContext.restore(state) for state in states]
+    shared: list[SharedBytes] = []
+    try:
+        if plug.pipeline.target == "batch":
+            entrypoint([(context.data.fullpath, context) for context in contexts])
+        else:
+            entrypoint(contexts[0].data.fullpath, contexts[0])
+        results = []
+        for context in contexts:
+            context.end_step()
+            results.append(context.export(shared))
+    except BaseException:
+        for block in shared:
+            block.release()
+        raise
+    finally:
+        for context in contexts:
+            context.close()
+    for block in shared:
+        block.hand_over()
+    return results
+
+
+def _binding_files(
+    source: PluginSpec, run: Callable[[], Any]
+) -> list[tuple[Path, FileContext]]:
+    """
+    The files a file or batch binding runs on.
+    """
+    if source.pipeline.target == "batch":
+        return run.args[0]
+    return [run.args[:2]]
+
+
+def _binding_name(source: PluginSpec, sandbox: Path, run: Callable[[], Any]) -> str:
+    if not isinstance(source.pipeline, FilePluginPipelineInfo) or not isinstance(
+        run, functools.partial
+    ):
+        return source.name
+    files = _binding_files(source, run)
+    first = files[0][0].relative_to(sandbox.absolute()).as_posix()
+    if len(files) == 1:
+        return f"{source.name}: {first}"
+    return f"{source.name}: {len(files)} files from {first}"
+
+
+def _selector(only: Optional[set[Path]], record: Optional[StepRecord]) -> SelectT:
+    """
+    Which matching files a file or batch step runs on: the ones in only (if
+    given) that the step record doesn't skip (if there is one).
+    """
+    if only is None and record is None:
+        return None
+    return lambda path: (only is None or path in only) and (
+        record is None or record.wanted(path)
+    )
+
+
+def _stamps(root: Path) -> dict[Path, tuple[int, int, int]]:
+    """
+    (mtime, size, inode) of every file under root.
+    """
+    stamps = {}
+    for dir_path, _, filenames in os.walk(root):
+        for name in filenames:
+            path = Path(dir_path, name)
+            with contextlib.suppress(FileNotFoundError):
+                st = path.stat()
+                stamps[path] = (st.st_mtime_ns, st.st_size, st.st_ino)
+    return stamps
+
+
+class _Pools(contextlib.AbstractContextManager):
+    """
+    Worker pools shared by every step of a run, keyed by kind and size.
+    """
+
+    def __init__(self):
+        self.pools: dict[tuple[str, int], futures.Executor] = {}
+        self.lock = threading.Lock()
+
+    def get(self, kind: str, workers: int) -> futures.Executor:
+        key = (kind, workers)
+        with self.lock:
+            if key in self.pools:
+                return self.pools[key]
+            if kind == "process":
+                share_tracker()
+                self.pools[key] = futures.ProcessPoolExecutor(max_workers=workers)
+            else:
+                self.pools[key] = futures.ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix="alter-worker"
+                )
+            return self.pools[key]
+
+    def __exit__(self, *exc_info):
+        for pool in self.pools.values():
+            pool.shutdown(wait=True, cancel_futures=True)
+        self.pools.clear()
+
+
+class _EventLoop(contextlib.AbstractContextManager):
+    """
+    The event loop that every async binding of a run is awaited on. It runs
+    on its own thread, started on first use, so that steps waiting on async
+    bindings block like they do on a pool.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+
+    def run(self, coroutine: Coroutine) -> Any:
+        # asyncio is only imported by runs with async plugins
+        import asyncio
+
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(
+                    target=self.loop.run_forever, name="alter-async", daemon=True
+                )
+                self.thread.start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def __exit__(self, *exc_info):
+        if self.loop is None:
+            return
+        self.run(self.loop.shutdown_asyncgens())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.loop = None
+
+
+async def run_concurrently(
+    bindings: list[Callable[[], Awaitable]],
+    limit: int,
+    names: Optional[list[str]] = None,
+):
+    """
+    Await bindings with at most limit of them running at once. The first
+    exception cancels the rest and is re-raised. With names, each binding is
+    traced.
+    """
+    import asyncio
+
+    semaphore = asyncio.Semaphore(limit)
+
+    async def one(i: int, run: Callable[[], Awaitable]):
+        async with semaphore:
+            if names is None:
+                await run()
+                return
+            with trace.tracer.span(names[i], "binding"):
+                await run()
+
+    tasks = [asyncio.ensure_future(one(i, run)) for i, run in enumerate(bindings)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+def run_bounded(
+    executor: futures.Executor,
+    bindings: Iterable[Callable[[], Any]],
+    max_pending: int,
+    names: Optional[list[str]] = None,
+    done: Optional[Callable[[int, Any], None]] = None,
+):
+    """
+    Submit bindings to the executor with at most max_pending in flight.
+    The first exception cancels everything still queued and is re-raised.
+    With names (one per binding) and tracing on, each binding is traced,
+    along with the time it spent queued. done(index, result) is called (on
+    this thread) as bindings finish.
+    """
+    pending: set[futures.Future] = set()
+    indexes: dict[futures.Future, int] = {}
+    traced: dict[futures.Future, str] = {}
+
+    def finish(future: futures.Future):
+        result = future.result()
+        if future in traced:
+            result, (submitted, started, ended, pid, tid) = result
+            name = traced.pop(future)
+            trace.tracer.record(name, "queue", submitted, started, pid=pid, tid=tid)
+            trace.tracer.record(name, "binding", started, ended, pid=pid, tid=tid)
+        index = indexes.pop(future)
+        if done is not None:
+            done(index, result)
+
+    try:
+        for i, run in enumerate(bindings):
+            if len(pending) >= max_pending:
+                finished, pending = futures.wait(
+                    pending, return_when=futures.FIRST_COMPLETED
+                )
+                for future in finished:
+                    finish(future)
+            if names is not None and trace.tracer.enabled:
+                future = executor.submit(trace.timed_call, run, time.perf_counter_ns())
+                traced[future] = names[i]
+            else:
+                future = executor.submit(run)
+            indexes[future] = i
+            pending.add(future)
+        finished, pending = futures.wait(pending, return_when=futures.FIRST_EXCEPTION)
+        for future in finished:
+            finish(future)
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+StepTimings = dict[str, tuple[float, float]]
+
+
+def schedule(
+    actions: list[DepLoadStruct],
+    run_one: Callable[[str], None],
+    max_steps: int,
+    exclusive: set[str],
+) -> StepTimings:
+    """
+    Run every step as soon as everything in its load_after set has finished,
+    with at most max_steps at once. Steps named in exclusive run alone.
+    Ties go to the earlier step in the load order, so max_steps=1 runs the
+    plan exactly in order, on the calling thread.
+    """
+    order = {item.name: i for i, item in enumerate(actions)}
+    waiting = {item.name: set(item.load_after) for item in actions}
+    dependents: defaultdict[str, list[str]] = defaultdict(list)
+    for item in actions:
+        for dependency in item.load_after:
+            dependents[dependency].append(item.name)
+    ready = [(order[name], name) for name, deps in waiting.items() if not deps]
+    heapq.heapify(ready)
+    timings: StepTimings = {}
+
+    def timed(name: str):
+        start = time.perf_counter()
+        try:
+            run_one(name)
+        finally:
+            timings[name] = (start, time.perf_counter())
+
+    if max_steps <= 1:
+        # plugins may rely on running on the main thread
+        while ready:
+            name = heapq.heappop(ready)[1]
+            timed(name)
+            for dependent in dependents[name]:
+                waiting[dependent].discard(name)
+                if len(waiting[dependent]) == 0:
+                    heapq.heappush(ready, (order[dependent], dependent))
+    else:
+        _schedule_threads(
+            ready, waiting, dependents, order, timed, max_steps, exclusive
+        )
+    if len(timings) != len(actions):
+        stuck = ", ".join(sorted(set(order) - set(timings)))
+        raise DependencyResolutionError(f"steps never became ready: {stuck}")
+    return timings
+
+
+def _schedule_threads(
+    ready: list[tuple[int, str]],
+    waiting: dict[str, set[str]],
+    dependents: dict[str, list[str]],
+    order: dict[str, int],
+    timed: Callable[[str], None],
+    max_steps: int,
+    exclusive: set[str],
 ):
-    ctx = ProjectContext()
+    running: dict[futures.Future, str] = {}
+    failure: Optional[BaseException] = None
+    with futures.ThreadPoolExecutor(
+        max_workers=max_steps, thread_name_prefix="alter-step"
+    ) as pool:
+        while (ready and failure is None) or running:
+            while ready and failure is None and len(running) < max_steps:
+                name = ready[0][1]
+                if running and (
+                    name in exclusive or not exclusive.isdisjoint(running.values())
+                ):
+                    break
+                heapq.heappop(ready)
+                running[pool.submit(timed, name)] = name
+            done, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    future.result()
+                except BaseException as e:
+                    failure = failure or e
+                    continue
+                for dependent in dependents[name]:
+                    waiting[dependent].discard(name)
+                    if len(waiting[dependent]) == 0:
+                        heapq.heappush(ready, (order[dependent], dependent))
+    if failure is not None:
+        raise failure
+
+
+def critical_path(
+    actions: list[DepLoadStruct], timings: StepTimings
+) -> tuple[list[str], float]:
+    """
+    Longest chain of dependent steps, by measured duration.
+    actions must be in load order (dependencies first).
+    """
+    longest: dict[str, tuple[float, Optional[str]]] = {}
     for item in actions:
-        source = plugins[item.name]
+        start, end = timings[item.name]
+        before = max(item.load_after, key=lambda n: longest[n][0], default=None)
+        base = longest[before][0] if before is not None else 0.0
+        longest[item.name] = (base + end - start, before)
+    if len(longest) == 0:
+        return [], 0.0
+    at: Optional[str] = max(longest, key=lambda n: longest[n][0])
+    total = longest[at][0]
+    path = []
+    while at is not None:
+        path.append(at)
+        at = longest[at][1]
+    return path[::-1], total
+
+
+def report_schedule(actions: list[DepLoadStruct], timings: StepTimings, wall: float):
+    if len(timings) == 0:
+        return
+    busy = sum(end - start for start, end in timings.values())
+    path, path_time = critical_path(actions, timings)
+    log.info(
+        f"{len(timings)} steps in {wall:.4f}s, effective parallelism "
+        f"{busy / wall if wall > 0 else 1.0:.2f}x"
+    )
+    log.info(
+        f"critical path {path_time:.4f}s: " + " -> ".join(map(lambda x: f"'{x}'", path))
+    )
+
+
+def run_steps(
+    sandbox: Path,
+    actions: list[DepLoadStruct],
+    plugins: dict[str, PluginSpec],
+    options: Optional[RunnerOptions] = None,
+    *,
+    ordered: bool = True,
+    manifest: Optional[BuildManifest] = None,
+    ctx: Optional[ProjectContext] = None,
+    only: Optional[set[Path]] = None,
+    written: Optional[set[Path]] = None,
+):
+    """
+    Run a plan. Unless ordered is set, independent steps run concurrently
+    as soon as their dependencies are done. With a manifest, file bindings
+    whose input is unchanged since the last run are skipped. Bindings of
+    async entrypoints are awaited concurrently, on one event loop per run.
+
+    A context passed in is kept open, so that it can be reused by a later
+    run. With only, file and batch steps only run on those files. With
+    written, the files project steps write, create or remove are added to it
+    (along with those of steps running at the same time).
+    """
+    options = options or RunnerOptions()
+    owned = ctx is None
+    if ctx is None:
+        ctx = ProjectContext(options.memory_budget, options.write_buffer)
+    if manifest is not None:
+        ctx.changed = manifest.changed
+
+    def execute(source: PluginSpec, bindings: list[Callable[[], Any]]):
+        asynchronous = bool(bindings) and inspect.iscoroutinefunction(bindings[0])
+        kind, workers = options.for_plugin(source, asynchronous)
+        pipeline = source.pipeline
+        if (
+            isinstance(pipeline, BatchPluginPipelineInfo)
+            and pipeline.chunk is None
+            and kind != "serial"
+            and bindings
+        ):
+            # no chunk size: one chunk per worker
+            items = [item for run in bindings for item in run.args[0]]
+            bindings = split_batch(bindings[0].func, items, -(-len(items) // workers))
+        names = None
+        if trace.tracer.enabled:
+            names = [_binding_name(source, sandbox, run) for run in bindings]
+        if kind == "async":
+            log.debug(
+                f"awaiting {len(bindings)} bindings of [bright_blue]{source.name}[/], "
+                f"{workers} at a time",
+                extra={"markup": True},
+            )
+            loop.run(run_concurrently(bindings, workers, names))
+            return
+        if kind == "serial" or len(bindings) <= 1:
+            if names is None:
+                for run in bindings:
+                    run()
+                return
+            for run, name in zip(bindings, names):
+                with trace.tracer.span(name, "binding"):
+                    run()
+            return
+        log.debug(
+            f"running {len(bindings)} bindings of [bright_blue]{source.name}[/] "
+            f"on {workers} {kind} workers",
+            extra={"markup": True},
+        )
+        if kind == "process":
+            run_in_processes(source, bindings, workers, names)
+            return
+        run_bounded(
+            pools.get(kind, workers),
+            bindings,
+            max(options.max_pending, workers),
+            names,
+        )
+
+    def run_in_processes(
+        source: PluginSpec,
+        bindings: list[Callable[[], Any]],
+        workers: int,
+        names: Optional[list[str]],
+    ):
+        # Contexts are exported as bindings are submitted, so that at most
+        # max_pending of them (and their shared memory) are alive at once.
+        # Cached values are left behind: workers compute what they read, and
+        # send back what they computed.
+        sent: dict[int, list[tuple[FileContext, FileState]]] = {}
+        blocks: dict[int, list[SharedBytes]] = {}
+
+        def exported():
+            for i, run in enumerate(bindings):
+                blocks[i] = []
+                sent[i] = [
+                    (context, context.export(blocks[i], values=()))
+                    for _, context in _binding_files(source, run)
+                ]
+                yield functools.partial(
+                    _run_in_worker, source, *(state for _, state in sent[i])
+                )
+
+        def merge(i: int, results: list[FileState]):
+            for block in blocks.pop(i):
+                block.release()
+            for (context, before), after in zip(sent.pop(i), results):
+                context.merge(after, before)
+
         try:
-            bindings = prepare(source, sandbox, ctx)
-            for run in bindings:
-                run()
+            run_bounded(
+                pools.get("process", workers),
+                exported(),
+                max(options.max_pending, workers),
+                names,
+                merge,
+            )
+        finally:
+            for pending in blocks.values():
+                for block in pending:
+                    block.release()
+
+    def run_one(name: str):
+        with trace.tracer.span(name, "plugin"):
+            run_plugin(name)
+
+    def run_plugin(name: str):
+        source = plugins[name]
+        tracked = written is not None and isinstance(
+            source.pipeline, ProjectPluginPipelineInfo
+        )
+        if tracked:
+            before = _stamps(sandbox)
+        try:
+            record: Optional[StepRecord] = None
+            if (
+                manifest is not None
+                and isinstance(source.pipeline, FilePluginPipelineInfo)
+                and source.runner.incremental
+            ):
+                # the manifest hashes inputs from disk, so earlier steps'
+                # pending writes have to be there first
+                ctx.flush()
+                record = manifest.step(source)
+            with trace.tracer.span(name, "prepare"):
+                bindings = prepare(source, sandbox, ctx, _selector(only, record))
+            execute(source, bindings)
+            with trace.tracer.span(name, "flush"):
+                ctx.end_step()
+                # the manifest hashes outputs from disk
+                if options.flush == "step" or record is not None:
+                    ctx.flush()
+            if record is not None:
+                record.record()
+            if tracked:
+                ctx.flush()
         except Exception as e:
             log.critical(
                 f"While preparing [bright_blue]{source.name}[/]: "
@@ -26,3 +654,43 @@ def run_steps(
                 extra={"markup": True},
             )
             raise RuntimeError(f"An error occured while preparing {source}")
+        finally:
+            if tracked:
+                after = _stamps(sandbox)
+                written.update(
+                    path
+                    for path in before.keys() | after.keys()
+                    if before.get(path) != after.get(path)
+                )
+
+    # Match every file step's rules in one pass over the sandbox up front;
+    # steps only match again if the files changed in between.
+    ctx.index(sandbox).prime(
+        compile_rules(tuple(plugins[item.name].pipeline.rules))
+        for item in actions
+        if isinstance(plugins[item.name].pipeline, FilePluginPipelineInfo)
+    )
+    exclusive = {item.name for item in actions if plugins[item.name].runner.ordered}
+    closing = contextlib.closing(ctx) if owned else contextlib.nullcontext()
+    with _Pools() as pools, _EventLoop() as loop, closing:
+        start = time.perf_counter()
+        timings = schedule(actions, run_one, 1 if ordered else options.steps, exclusive)
+        ctx.flush()
+        if ctx.writes.written:
+            log.debug(f"{ctx.writes.written} written files saved")
+        wall = time.perf_counter() - start
+        resident = ctx.memory.report()
+    report_schedule(actions, timings, wall)
+    if ctx.cache_stats.hits or ctx.cache_stats.misses:
+        log.info(f"property cache hits: {ctx.cache_stats.summary()}")
+    if resident:
+        log.info(
+            "cached in memory at the end: "
+            + ", ".join(
+                f"{name} {count} files {format_size(size)}"
+                for name, (count, size) in sorted(resident.items())
+            )
+            + f" ({ctx.memory.evictions} evicted)"
+        )
+    if manifest is not None:
+        manifest.save()
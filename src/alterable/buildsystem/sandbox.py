@@ -0,0 +1,302 @@
+"""
+Sandbox population. The sandbox can be a full copy of the sources (the
+default), or be made of reflinks or hardlinks to them so that creating it
+doesn't duplicate any data.
+
+Reflinks are copy-on-write in the filesystem already. Hardlinks share the
+source's inode, so the sandbox watches for files being opened for writing
+(through an audit hook) and replaces the link with a private copy first.
+
+The audit hook only sees this interpreter: subprocesses, C extensions and
+process pool workers write straight through a link. So hardlinks are only
+used when asked for by name ('auto' doesn't try them), never when running
+as root, and the linked sources are made read-only while a sandbox links to
+them: writing through a link fails instead of changing the source. The
+sources get their permissions back when the sandbox is removed (not if the
+process is killed).
+"""
+
+import contextlib
+import errno
+import logging
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+from .modes import SANDBOX_MODES
+
+try:
+    import fcntl
+except ImportError:  # not on Windows
+    fcntl = None
+
+log = logging.getLogger("sandbox")
+
+_FICLONE = 0x40049409  # linux/fs.h
+_WRITABLE = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+_WRITE_FLAGS = os.O_WRONLY | os.O_RDWR | os.O_APPEND | os.O_TRUNC
+_UNSUPPORTED = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EPERM}
+
+
+def reflink(source: str, target: str):
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "reflinks need fcntl")
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+    shutil.copystat(source, target)
+
+
+class _Populator:
+    """
+    Places files into the sandbox with the cheapest method that works, and
+    falls back (for the rest of the run) as soon as one isn't supported.
+    """
+
+    def __init__(self, mode: str, exclude: Optional[Callable[[str], bool]] = None):
+        if mode not in SANDBOX_MODES:
+            raise ValueError(f"unknown sandbox mode: {mode}")
+        self.methods = {
+            "copy": ["copy"],
+            "reflink": ["reflink", "copy"],
+            "hardlink": ["hardlink", "copy"],
+            "auto": ["reflink", "copy"],
+        }[mode]
+        if "hardlink" in self.methods and _is_root():
+            # read-only sources wouldn't stop anything
+            log.warning("Not hardlinking sources as root, copying them instead")
+            self.methods.remove("hardlink")
+        # sandbox path -> source
+        self.linked: dict[str, str] = {}
+        self.counts: dict[str, int] = {}
+        # tested against sandbox-relative posix paths
+        self.exclude = exclude
+
+    def place(self, source: str, target: str):
+        while True:
+            method = self.methods[0]
+            try:
+                if method == "reflink":
+                    reflink(source, target)
+                elif method == "hardlink":
+                    os.link(source, target)
+                    self.linked[target] = source
+                else:
+                    shutil.copy2(source, target)
+                self.counts[method] = self.counts.get(method, 0) + 1
+                return
+            except OSError as e:
+                if method == "copy" or e.errno not in _UNSUPPORTED:
+                    raise
+                log.debug(f"{method} not supported here ({e}), falling back")
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(target)
+                self.methods.pop(0)
+
+    def tree(self, source: str, target: str, prefix: str = ""):
+        """
+        prefix: path of target inside the sandbox, for exclude.
+        """
+        os.makedirs(target, exist_ok=True)
+        shutil.copystat(source, target)
+        for dir_path, dirnames, filenames in os.walk(source):
+            rel = os.path.relpath(dir_path, source)
+            out_dir = os.path.normpath(os.path.join(target, rel))
+            rel_dir = Path(prefix, rel).as_posix()
+            for name in dirnames:
+                os.makedirs(os.path.join(out_dir, name), exist_ok=True)
+            for name in filenames:
+                if self.exclude is not None and self.exclude(f"{rel_dir}/{name}"):
+                    self.counts["excluded"] = self.counts.get("excluded", 0) + 1
+                    continue
+                self.place(os.path.join(dir_path, name), os.path.join(out_dir, name))
+
+
+def _is_root() -> bool:
+    return hasattr(os, "geteuid") and os.geteuid() == 0
+
+
+class _CopyOnWrite:
+    """
+    Breaks hardlinks into private copies right before a sandbox file is
+    opened for writing or truncated. Audit hooks can't be removed, so there
+    is one hook for the process that consults every active sandbox.
+
+    Linked sources are read-only for as long as any sandbox links to them.
+    """
+
+    def __init__(self):
+        # sandbox path -> source
+        self.linked: dict[str, str] = {}
+        # source -> (permissions before linking, links to it)
+        self.sources: dict[str, tuple[int, int]] = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.installed = False
+
+    def register(self, linked: dict[str, str]):
+        with self.lock:
+            for path, source in linked.items():
+                self._protect(source)
+                self.linked[path] = source
+            if linked and not self.installed:
+                sys.addaudithook(self.hook)
+                self.installed = True
+
+    def unregister(self, paths: Iterable[str]):
+        with self.lock:
+            for path in paths:
+                source = self.linked.pop(path, None)
+                if source is not None:
+                    self._release(source)
+
+    def _protect(self, source: str):
+        if source in self.sources:
+            mode, links = self.sources[source]
+            self.sources[source] = (mode, links + 1)
+            return
+        mode = stat.S_IMODE(os.stat(source).st_mode)
+        os.chmod(source, mode & ~_WRITABLE)
+        self.sources[source] = (mode, 1)
+
+    def _release(self, source: str):
+        mode, links = self.sources[source]
+        if links > 1:
+            self.sources[source] = (mode, links - 1)
+            return
+        del self.sources[source]
+        try:
+            # unless it was replaced (or changed) meanwhile
+            if stat.S_IMODE(os.stat(source).st_mode) == mode & ~_WRITABLE:
+                os.chmod(source, mode)
+        except OSError as e:
+            log.warning(f"Couldn't restore the permissions of {source}: {e}")
+
+    def permissions(self, path: str) -> Optional[int]:
+        source = self.linked.get(path)
+        if source is None:
+            return None
+        return self.sources[source][0]
+
+    def hook(self, event: str, args: tuple[Any, ...]):
+        if not self.linked or getattr(self.local, "busy", False):
+            return
+        if event == "open":
+            path, mode, flags = args
+            if mode is not None:
+                writing = any(c in mode for c in "wax+")
+            else:
+                writing = bool(flags & _WRITE_FLAGS)
+        elif event == "os.truncate":
+            path, writing = args[0], True
+        else:
+            return
+        if not writing or not isinstance(path, (str, os.PathLike)):
+            return
+        path = os.path.abspath(path)
+        if path in self.linked:
+            self.materialize(path)
+
+    def materialize(self, path: str):
+        self.local.busy = True
+        try:
+            with self.lock:
+                if path not in self.linked:
+                    return
+                fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+                os.close(fd)
+                shutil.copy2(path, tmp)
+                os.chmod(tmp, self.permissions(path))
+                os.replace(tmp, path)
+                self._release(self.linked.pop(path))
+        finally:
+            self.local.busy = False
+
+
+_cow = _CopyOnWrite()
+
+
+@contextlib.contextmanager
+def populate(
+    sources: list[str],
+    mode: str = "copy",
+    parent: Optional[Path] = None,
+    exclude: Optional[Callable[[str], bool]] = None,
+) -> Iterator[str]:
+    """
+    Create a temporary sandbox holding every source. Link modes put the
+    sandbox under parent, because links can't cross filesystems. Files for
+    which exclude returns True (given their path in the sandbox) are left out.
+    """
+    populator = _Populator(mode, exclude)
+    if parent is not None and mode != "copy":
+        parent.mkdir(parents=True, exist_ok=True)
+    else:
+        parent = None
+    with tempfile.TemporaryDirectory(dir=parent) as tmpdir:
+        tmpdir = os.path.abspath(tmpdir)
+        for source in sources:
+            name = os.path.basename(source)
+            if mode == "copy" and exclude is None:
+                if os.path.isdir(source):
+                    shutil.copytree(source, os.path.join(tmpdir, name))
+                else:
+                    shutil.copy(source, tmpdir)
+            elif os.path.isdir(source):
+                populator.tree(source, os.path.join(tmpdir, name), name)
+            elif exclude is None or not exclude(name):
+                populator.place(source, os.path.join(tmpdir, name))
+        if mode != "copy" or exclude is not None:
+            log.debug(
+                "Sandbox %s populated: %s",
+                tmpdir,
+                ", ".join(f"{n} {m}" for m, n in populator.counts.items()),
+            )
+        try:
+            _cow.register(populator.linked)
+            yield tmpdir
+        finally:
+            _cow.unregister(populator.linked)
+
+
+@contextlib.contextmanager
+def replacing(output: Path) -> Iterator[Path]:
+    """
+    A staging directory that takes the place of output (a directory) once
+    the block completes, so output is never seen half-written.
+    """
+    output.parent.mkdir(parents=True, exist_ok=True)
+    staging = output.with_name(f".{output.name}.new")
+    previous = output.with_name(f".{output.name}.old")
+    for leftover in (staging, previous):
+        shutil.rmtree(leftover, ignore_errors=True)
+    staging.mkdir()
+    try:
+        yield staging
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    if output.exists():
+        os.replace(output, previous)
+    os.replace(staging, output)
+    shutil.rmtree(previous, ignore_errors=True)
+
+
+def export(sandbox: str, output: Path, mode: str = "copy"):
+    """
+    Replace the output directory with the contents of a sandbox. Outputs are
+    never hardlinked: editing them mustn't change the sources.
+    """
+    populator = _Populator("reflink" if mode in ("reflink", "auto") else "copy")
+    with replacing(output) as staging:
+        # not tree(): the sandbox directory itself is private to this user
+        for name in os.listdir(sandbox):
+            source, target = os.path.join(sandbox, name), os.path.join(staging, name)
+            if os.path.isdir(source):
+                populator.tree(source, target)
+            else:
+                populator.place(source, target)
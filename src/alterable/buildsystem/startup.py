@@ -0,0 +1,60 @@
+"""
+Startup profiling (alterable --profile-startup): what importing everything
+a build needs before it starts working costs, by package and by module.
+"""
+
+import os
+import subprocess
+import sys
+from collections import Counter
+from typing import Optional
+
+# what a normal run imports before loading the configuration (the config
+# loader itself is only needed when the configuration isn't cached)
+_STARTUP = "import alterable.buildsystem.cli as cli; cli.setup_logging()"
+
+
+def measure() -> list[tuple[str, int, int]]:
+    """
+    (module, self µs, cumulative µs) for every module imported at startup,
+    measured in a fresh interpreter.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _STARTUP],
+        capture_output=True,
+        text=True,
+        env=env,
+        check=True,
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        if not self_us.strip().isdigit():
+            continue  # header
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+
+def profile_startup(budget_ms: Optional[float] = None, top: int = 15) -> int:
+    """
+    Print the breakdown. Returns 1 if startup took longer than budget_ms.
+    """
+    modules = measure()
+    total = sum(self_us for _, self_us, _ in modules) / 1000
+    by_package: Counter[str] = Counter()
+    for name, self_us, _ in modules:
+        by_package[name.split(".")[0]] += self_us
+    print(f"startup imports: {len(modules)} modules, {total:.1f} ms")
+    print("\nby package:")
+    for package, self_us in by_package.most_common(top):
+        print(f"  {self_us / 1000:8.1f} ms  {package}")
+    print("\nslowest modules (excluding what they import):")
+    for name, self_us, _ in sorted(modules, key=lambda m: m[1], reverse=True)[:top]:
+        print(f"  {self_us / 1000:8.1f} ms  {name}")
+    if budget_ms is not None and total > budget_ms:
+        print(f"\nover the startup budget: {total:.1f} ms > {budget_ms:.1f} ms")
+        return 1
+    return 0
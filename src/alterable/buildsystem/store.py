@@ -0,0 +1,109 @@
+"""
+Content-addressed file storage: every file is kept once, named after the
+sha256 of its contents (objects/ab/cdef...).
+"""
+
+import hashlib
+import os
+import shutil
+import stat
+import tempfile
+from pathlib import Path
+from typing import Iterable, Optional
+
+from .sandbox import replacing
+
+# objects being written; prune leaves them alone, another process may be
+# about to move one into place
+TEMP_PREFIX = ".tmp-"
+
+
+def hash_file(path: Path) -> Optional[str]:
+    try:
+        with open(path, "rb") as f:
+            return hashlib.file_digest(f, "sha256").hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+class ObjectStore:
+    def __init__(self, root: Path, *, read_only: bool = False):
+        """
+        read_only: make stored files read-only, for stores whose objects are
+        hardlinked to from elsewhere and must not be edited in place.
+        """
+        self.root = root
+        self.read_only = read_only
+
+    def path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest[2:]
+
+    def __contains__(self, digest: str) -> bool:
+        return self.path(digest).exists()
+
+    def add(self, path: Path, digest: str) -> bool:
+        """
+        Store a copy of path, whose hash is digest. False if it was already there.
+        """
+        target = self.path(digest)
+        if target.exists():
+            return False
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            dir=target.parent, prefix=TEMP_PREFIX, delete=False
+        ) as tmp:
+            with open(path, "rb") as f:
+                shutil.copyfileobj(f, tmp)
+        if self.read_only:
+            os.chmod(tmp.name, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.replace(tmp.name, target)
+        return True
+
+    def prune(self, referenced: Iterable[str]):
+        """
+        Remove every object not in referenced. Only safe while no other
+        process is adding objects that aren't referenced yet.
+        """
+        keep = set(referenced)
+        if not self.root.exists():
+            return
+        for bucket in self.root.iterdir():
+            if not bucket.is_dir():
+                continue
+            for stored in bucket.iterdir():
+                if stored.name.startswith(TEMP_PREFIX):
+                    continue
+                if bucket.name + stored.name not in keep:
+                    stored.unlink(missing_ok=True)
+
+
+# path in the output -> [sha256, size]
+OutputManifest = dict[str, tuple[str, int]]
+
+
+def export_to_store(sandbox: str, output: Path, store: ObjectStore) -> OutputManifest:
+    """
+    Replace the output directory with the contents of a sandbox, storing
+    each file once in store and hardlinking to it. Files that can't be
+    linked (e.g. the store is on another filesystem) are copied.
+    """
+    manifest: OutputManifest = {}
+    with replacing(output) as staging:
+        for dir_path, _, filenames in os.walk(sandbox):
+            rel_dir = os.path.relpath(dir_path, sandbox)
+            out_dir = os.path.normpath(os.path.join(staging, rel_dir))
+            os.makedirs(out_dir, exist_ok=True)
+            for name in filenames:
+                source = Path(dir_path, name)
+                digest = hash_file(source)
+                if digest is None:
+                    continue
+                store.add(source, digest)
+                target = os.path.join(out_dir, name)
+                try:
+                    os.link(store.path(digest), target)
+                except OSError:
+                    shutil.copyfile(store.path(digest), target)
+                rel = Path(rel_dir, name).as_posix()
+                manifest[rel] = (digest, source.stat().st_size)
+    return manifest
@@ -0,0 +1,207 @@
+"""
+Build targets: the variants of a project listed in the 'buildsystem' section.
+
+Every target starts from its own snapshot of the preprocessed sandbox, minus
+the files matching its 'exclude' rules, runs its own plan and is exported to
+its own output directory. Targets run in parallel worker processes.
+
+With runner.output set to 'store', outputs are deduplicated: every distinct
+file is kept once in a content-addressed store and the target directories
+are made of hardlinks to it (read-only, so they can't be edited in place).
+"""
+
+import concurrent.futures as futures
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+from ..plugins.matcher import compile_rules
+from ..plugins.structure import PluginSpec
+from ..util import cache_dir, format_size
+from . import trace
+from .incremental import BuildManifest, prune_objects
+from .resolves import DepLoadStruct
+from .runner import RunnerOptions, run_steps
+from .sandbox import export, populate
+from .store import ObjectStore, OutputManifest, export_to_store
+
+log = logging.getLogger("targets")
+
+
+class BuildTarget:
+    def __init__(
+        self,
+        name: str,
+        *,
+        use: list[str],
+        ordered: bool = True,
+        exclude: Optional[list[str]] = None,
+        output: Optional[Path] = None,
+    ):
+        self.name = name
+        self.use = use
+        self.ordered = ordered
+        # rules like a file pipeline's 'match', for sandbox-relative paths
+        self.exclude = exclude or []
+        self.output = output or Path("build") / name
+        self.steps: list[DepLoadStruct] = []
+
+    @classmethod
+    def load(cls, name: str, template: dict):
+        use = template.get("use", [])
+        if not isinstance(use, list):
+            raise ValueError(f"buildsystem.{name}.use should be a list")
+        return cls(
+            name,
+            use=use,
+            ordered=template.get("ordered", True),
+            exclude=template.get("exclude", []),
+            output=Path(template["output"]) if "output" in template else None,
+        )
+
+    def __repr__(self):
+        return f"<BuildTarget {self.name} -> {self.output}>"
+
+
+def output_store() -> ObjectStore:
+    return ObjectStore(cache_dir() / "outputs" / "objects", read_only=True)
+
+
+def _manifest_path(name: str) -> Path:
+    return cache_dir() / "outputs" / f"{name}.json"
+
+
+def build_target(
+    target: BuildTarget,
+    sandbox: str,
+    plugins: dict[str, PluginSpec],
+    options: RunnerOptions,
+) -> Optional[OutputManifest]:
+    """
+    Build one target from the preprocessed sandbox. Runs in a worker process.
+    Returns what was exported, in 'store' output mode.
+    """
+    exclude = compile_rules(tuple(target.exclude)) if target.exclude else None
+    sources = [os.path.join(sandbox, name) for name in sorted(os.listdir(sandbox))]
+    with populate(sources, options.sandbox, cache_dir() / "sandbox", exclude) as tmpdir:
+        log.debug(
+            f"Building [bright_blue]{target.name}[/] in {tmpdir}",
+            extra={"markup": True},
+        )
+        manifest = None
+        if options.incremental:
+            manifest = BuildManifest.load(
+                cache_dir(), f"build-{target.name}", Path(tmpdir)
+            )
+        run_steps(
+            Path(tmpdir),
+            target.steps,
+            plugins,
+            options,
+            ordered=target.ordered,
+            manifest=manifest,
+        )
+        if options.output != "store":
+            export(tmpdir, target.output, options.sandbox)
+            return None
+        exported = export_to_store(tmpdir, target.output, output_store())
+    path = _manifest_path(target.name)
+    with tempfile.NamedTemporaryFile("w", dir=path.parent, delete=False) as tmp:
+        json.dump(exported, tmp)
+    os.replace(tmp.name, path)
+    return exported
+
+
+def _build_in_worker(
+    target: BuildTarget,
+    sandbox: str,
+    plugins: dict[str, PluginSpec],
+    options: RunnerOptions,
+    tracing: bool,
+) -> tuple[Optional[OutputManifest], list[trace.EventT]]:
+    if tracing:
+        # a forked worker starts with a copy of the parent's events
+        trace.start_tracing()
+    with trace.tracer.span(target.name, "target"):
+        exported = build_target(target, sandbox, plugins, options)
+    return exported, getattr(trace.tracer, "events", [])
+
+
+def _report_store(exported: list[OutputManifest]):
+    """
+    Log how much space deduplication saved, then drop stored files no
+    target uses anymore.
+    """
+    total = sum(size for files in exported for _, size in files.values())
+    unique = {digest: size for files in exported for digest, size in files.values()}
+    stored = sum(unique.values())
+    log.info(
+        f"{sum(map(len, exported))} output files, {format_size(total)} across "
+        f"targets, {format_size(stored)} stored: {format_size(total - stored)} saved"
+    )
+    referenced: set[str] = set()
+    for path in _manifest_path("*").parent.glob("*.json"):
+        try:
+            with open(path) as f:
+                referenced.update(digest for digest, _ in json.load(f).values())
+        except ValueError:
+            continue
+    output_store().prune(referenced)
+
+
+def build_all(
+    targets: list[BuildTarget],
+    sandbox: str,
+    plugins: dict[str, PluginSpec],
+    options: RunnerOptions,
+) -> list[str]:
+    """
+    Build every target. Returns the names of those that failed.
+    """
+    failed: list[str] = []
+    exported: list[OutputManifest] = []
+    if options.output == "store":
+        _manifest_path("*").parent.mkdir(parents=True, exist_ok=True)
+    workers = min(len(targets), options.workers)
+    with futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = {
+            pool.submit(
+                _build_in_worker,
+                target,
+                sandbox,
+                # only what the worker needs to unpickle
+                {step.name: plugins[step.name] for step in target.steps},
+                options,
+                trace.tracer.enabled,
+            ): target
+            for target in targets
+        }
+        for job in futures.as_completed(jobs):
+            target = jobs[job]
+            try:
+                result, events = job.result()
+            except Exception as e:
+                failed.append(target.name)
+                log.critical(
+                    f"Build target [bright_blue]{target.name}[/] [bold red]failed[/] "
+                    f"because of [red][bold]{type(e).__name__}[/]: [italic]{e}[/][/]",
+                    extra={"markup": True},
+                )
+            else:
+                log.info(
+                    f"Built [bright_blue]{target.name}[/] into {target.output}",
+                    extra={"markup": True},
+                )
+                if result is not None:
+                    exported.append(result)
+                if isinstance(trace.tracer, trace.Tracer):
+                    trace.tracer.merge(events)
+    if exported and not failed:
+        _report_store(exported)
+    if options.incremental:
+        # the workers share the store, so only now is nothing being added
+        prune_objects(cache_dir())
+    return failed
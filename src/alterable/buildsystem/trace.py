@@ -0,0 +1,131 @@
+"""
+Tracing (alterable --trace out.json): spans for each phase, plugin step and
+file binding, exported as Chrome trace events (chrome://tracing, Perfetto).
+
+Code reports spans to the module-level `tracer`, which is a NullTracer unless
+tracing was asked for, so tracing costs next to nothing when it's off. Time
+stamps come from perf_counter_ns, which is the system-wide monotonic clock on
+Linux, so spans recorded in worker processes line up with the parent's.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, ContextManager, Iterator
+
+log = logging.getLogger("trace")
+
+EventT = dict[str, Any]
+
+
+class NullTracer:
+    enabled = False
+
+    def span(self, name: str, category: str, **args: Any) -> ContextManager:
+        return _NULL_SPAN
+
+    def record(self, name: str, category: str, start: int, end: int, **args: Any):
+        pass
+
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+class Tracer(NullTracer):
+    enabled = True
+
+    def __init__(self):
+        self.events: list[EventT] = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str, **args: Any) -> Iterator[None]:
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.record(name, category, start, time.perf_counter_ns(), **args)
+
+    def record(
+        self,
+        name: str,
+        category: str,
+        start: int,
+        end: int,
+        *,
+        pid: int = 0,
+        tid: int = 0,
+        **args: Any,
+    ):
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": start / 1000,
+            "dur": (end - start) / 1000,
+            "pid": pid or os.getpid(),
+            "tid": tid or threading.get_ident(),
+        }
+        if args:
+            event["args"] = args
+        with self._lock:
+            self.events.append(event)
+
+    def merge(self, events: list[EventT]):
+        """
+        Add events recorded by another process.
+        """
+        with self._lock:
+            self.events.extend(events)
+
+    def export(self, path: Path):
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+    def summary(self, top: int = 10):
+        """
+        Log the slowest spans, and the total time spent in each category.
+        """
+        totals: dict[str, float] = {}
+        for event in self.events:
+            totals[event["cat"]] = totals.get(event["cat"], 0) + event["dur"]
+        log.info(
+            f"{len(self.events)} spans; total by kind: "
+            + ", ".join(
+                f"{category} {total / 1e6:.3f}s"
+                for category, total in sorted(totals.items(), key=lambda t: -t[1])
+            )
+        )
+        slowest = sorted(self.events, key=lambda e: e["dur"], reverse=True)[:top]
+        log.info(
+            f"slowest {len(slowest)} spans:\n"
+            + "\n".join(
+                f"  {event['dur'] / 1e6:8.4f}s  {event['cat']:<8} {event['name']}"
+                for event in slowest
+            )
+        )
+
+
+tracer: NullTracer = NullTracer()
+
+
+def start_tracing() -> Tracer:
+    global tracer
+    tracer = Tracer()
+    return tracer
+
+
+def timed_call(run: Callable[[], Any], submitted: int) -> tuple[Any, tuple[int, ...]]:
+    """
+    Pool entry for traced bindings: runs one and returns its result along
+    with (submitted, started, ended, process id, thread id), so that the
+    caller can record where it ran and how long it was queued.
+    """
+    started = time.perf_counter_ns()
+    result = run()
+    ended = time.perf_counter_ns()
+    return result, (submitted, started, ended, os.getpid(), threading.get_ident())
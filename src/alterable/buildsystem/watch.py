@@ -0,0 +1,233 @@
+"""
+Watch mode (alterable watch): build once, then keep the process, its loaded
+plugins, the preprocessed sandbox and the project context around, and rebuild
+whenever a source changes.
+
+Sources are polled. A changed source is copied into the sandbox again and
+only the file steps matching it run on it; project steps run again with
+`changed` set to the files involved. Files that project steps wrote in the
+previous run are put back as they are in the sources (or removed, if they
+aren't sources) and run through again with the changed ones, so project
+steps never see their own output as input. When a project step comes before
+a file step in the plan, it would see the other files already through that
+file step, so the whole sandbox is reset and the plan runs on everything
+instead. Build targets are then rebuilt from the updated sandbox (with
+runner.incremental on, they skip unchanged files too).
+"""
+
+import contextlib
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Optional
+
+from ..plugins.shared_context import ProjectContext
+from ..plugins.structure import ProjectPluginPipelineInfo
+from .cli import Project, build, collect, prepare_env, preprocess
+from .sandbox import _cow
+
+log = logging.getLogger("watch")
+
+# source file -> (mtime, size)
+StampsT = dict[str, tuple[int, int]]
+
+
+class SourceWatcher:
+    """
+    Polls the sources matched by the collect rules, including files added
+    to or removed from matched directories.
+    """
+
+    def __init__(self, rules: list[str]):
+        self.rules = rules
+        # source file -> its path inside the sandbox
+        self.targets: dict[str, str] = {}
+        self.stamps = self.scan()
+
+    def scan(self) -> StampsT:
+        stamps: StampsT = {}
+        for source in collect(self.rules):
+            name = os.path.basename(source)
+            if not os.path.isdir(source):
+                self._stamp(stamps, source, name)
+                continue
+            for dir_path, _, filenames in os.walk(source):
+                rel = os.path.relpath(dir_path, source)
+                for file in filenames:
+                    target = os.path.normpath(os.path.join(name, rel, file))
+                    self._stamp(stamps, os.path.join(dir_path, file), target)
+        return stamps
+
+    def _stamp(self, stamps: StampsT, path: str, target: str):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return
+        stamps[path] = (st.st_mtime_ns, st.st_size)
+        self.targets[path] = target
+
+    def poll(self) -> dict[str, Optional[tuple[int, int]]]:
+        """
+        Sources that changed since the last poll, with their new stamp
+        (None for removed ones).
+        """
+        current = self.scan()
+        changed: dict[str, Optional[tuple[int, int]]] = {}
+        for path in current.keys() | self.stamps.keys():
+            if current.get(path) != self.stamps.get(path):
+                changed[path] = current.get(path)
+        self.stamps = current
+        return changed
+
+
+def _replace(target: Path, source: Optional[str]):
+    """
+    Put source (or nothing) at target in the sandbox.
+    """
+    # the old file may be a hardlink to the source: replace, don't write
+    _cow.unregister({str(target)})
+    with contextlib.suppress(FileNotFoundError):
+        target.unlink()
+    if source is not None:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(source, target)
+
+
+def _sync(
+    watcher: SourceWatcher, sandbox: Path, changed: dict, written: set[Path]
+) -> set[Path]:
+    """
+    Bring changed sources into the sandbox, and reset the files project
+    steps wrote to their sources. Returns the sandbox paths of both.
+    """
+    paths: set[Path] = set()
+    for source, stamp in changed.items():
+        target = sandbox / watcher.targets[source]
+        _replace(target, source if stamp is not None else None)
+        paths.add(target)
+    sources = {sandbox / target: source for source, target in watcher.targets.items()}
+    for target in written - paths:
+        source = sources.get(target)
+        _replace(target, source if source in watcher.stamps else None)
+        paths.add(target)
+    return paths
+
+
+def _reset(watcher: SourceWatcher, sandbox: Path):
+    """
+    Put the whole sandbox back as it is in the sources.
+    """
+    sources = {
+        sandbox / target: source
+        for source, target in watcher.targets.items()
+        if source in watcher.stamps
+    }
+    for dir_path, _, filenames in os.walk(sandbox):
+        for name in filenames:
+            path = Path(dir_path, name)
+            if path not in sources:
+                _replace(path, None)
+    for target, source in sources.items():
+        _replace(target, source)
+
+
+def _runs_everything(project: Project) -> bool:
+    """
+    Whether a project step comes before a file step in the plan. A rebuild
+    of only the changed files can't give it what a clean build would.
+    """
+    seen_project = False
+    for step in project.preprocess or []:
+        if isinstance(project.plugins[step.name].pipeline, ProjectPluginPipelineInfo):
+            seen_project = True
+        elif seen_project:
+            return True
+    return False
+
+
+def rebuild(
+    project: Project,
+    watcher: SourceWatcher,
+    sandbox: Path,
+    ctx: ProjectContext,
+    changed: dict,
+    written: set[Path],
+) -> bool:
+    """
+    Preprocess and build again after changed sources (as returned by
+    SourceWatcher.poll). written holds the files project steps wrote in the
+    last run, and is updated for the next one. False if it failed.
+    """
+    paths = {sandbox / watcher.targets[source] for source in changed}
+    only: Optional[set[Path]] = None
+    if _runs_everything(project):
+        _reset(watcher, sandbox)
+        for file in ctx.files.values():
+            file.data.invalidate()
+    else:
+        only = _sync(watcher, sandbox, changed, written)
+        for path in only:
+            if str(path) in ctx.files:
+                ctx.files[str(path)].data.invalidate()
+        paths = only
+    ctx.changed = paths
+    written.clear()
+    return preprocess(project, sandbox, ctx, only=only, written=written) and build(
+        project, sandbox
+    )
+
+
+def watch(project: Project, interval: float) -> int:
+    watcher = SourceWatcher(project.rules)
+    options = project.options
+    mode = options.sandbox
+    if mode == "hardlink":
+        # hardlinked sources are read-only while the sandbox exists
+        log.info(
+            "Copying the sources instead of hardlinking them, to keep them editable"
+        )
+        mode = "copy"
+    with prepare_env(collect(project.rules), mode) as presrc:
+        sandbox = Path(presrc)
+        ctx = ProjectContext(options.memory_budget, options.write_buffer)
+        # files written by project steps during the last run
+        written: set[Path] = set()
+        try:
+            if preprocess(project, sandbox, ctx, written=written):
+                build(project, sandbox)
+            if _runs_everything(project):
+                log.info(
+                    "a project step comes before file steps: every change "
+                    "preprocesses all the sources again"
+                )
+            log.info(f"watching {len(watcher.stamps)} source files, Ctrl+C to stop")
+            while True:
+                time.sleep(interval)
+                changed = watcher.poll()
+                if not changed:
+                    continue
+                detected = time.time_ns()
+                # edits are timed from the newest modification time involved
+                edited = max(
+                    (stamp[0] for stamp in changed.values() if stamp is not None),
+                    default=detected,
+                )
+                log.info(
+                    f"{len(changed)} sources changed: "
+                    + ", ".join(sorted(watcher.targets[s] for s in changed)[:8])
+                )
+                ok = rebuild(project, watcher, sandbox, ctx, changed, written)
+                done = time.time_ns()
+                log.info(
+                    f"rebuilt in {(done - detected) / 1e9:.3f}s, "
+                    f"{(done - edited) / 1e9:.3f}s from edit to output"
+                    + ("" if ok else " [bold red](failed)[/]"),
+                    extra={"markup": True},
+                )
+        except KeyboardInterrupt:
+            log.info("stopped watching")
+        finally:
+            ctx.close()
+    return 0
@@ -1,49 +1,84 @@
-import importlib
+"""
+Builtin plugins. They are listed from the static manifest below, so that
+starting up doesn't import any of them (or their dependencies): a module is
+only imported when a plan that uses it runs. Modules provide main() and
+optionally configure(options).
+"""
+
+import importlib.util as import_util
 import logging
-from typing import Protocol, cast
+from typing import NamedTuple, Optional
 
-from ..plugins.structure import PluginSpec, PreloadPluginSpec
+from ..plugins.structure import (
+    FilePluginPipelineInfo,
+    PluginRunnerInfo,
+    PreloadPluginSpec,
+)
 
 log = logging.getLogger("plugin builtins")
-PLUGIN_LIST = [".parse_html", ".file_context_debugger"]
 
 
-class BuiltinPluginModule(Protocol):
-    def about(self) -> PreloadPluginSpec: ...
+class Builtin(NamedTuple):
+    module: str
+    # top-level packages that must be installed for the plugin to be listed
+    requires: list[str]
+    spec: PreloadPluginSpec
 
 
-def list_builtins() -> list[PluginSpec]:
-    plugins: list[PluginSpec] = []
-    for target in PLUGIN_LIST:
-        try:
-            log.debug(
-                f"Constructing [bright_blue]{target}[/] by loading its source file",
-                extra={"markup": True},
-            )
-            module = importlib.import_module(target, __name__)
-            try:
-                module.about
-            except AttributeError:
-                raise TypeError(
-                    f"Cannot load builtin plugin {target} because it is missing plugin information"
-                )
-            module_typed: BuiltinPluginModule = cast(BuiltinPluginModule, module)  # smh
-            plugin = module_typed.about()
-            # Link correctly
-            plugin.module = module
-            plugins.append(plugin)
-        except ImportError as e:
+def manifest() -> list[Builtin]:
+    return [
+        Builtin(
+            ".parse_html",
+            ["bs4"],
+            PreloadPluginSpec(
+                name="builtin/parse_html",
+                pipeline=FilePluginPipelineInfo("main", [r".*\.html$"]),
+                provides={"parse_html", "builtin/parse_html"},
+                use=[],
+                runner=PluginRunnerInfo(incremental=False),
+            ),
+        ),
+        Builtin(
+            ".file_context_debugger",
+            [],
+            PreloadPluginSpec(
+                name="builtin/file_ctx_dbg",
+                pipeline=FilePluginPipelineInfo("main", [r""]),
+                provides={"file_ctx_dbg", "builtin/file_ctx_dbg"},
+                use=[],
+                runner=PluginRunnerInfo(incremental=False),
+            ),
+        ),
+    ]
+
+
+def list_builtins(
+    options: Optional[dict[str, dict]] = None,
+) -> list[PreloadPluginSpec]:
+    """
+    Every builtin plugin whose requirements are installed. options holds the
+    'builtins' section of the configuration, keyed by plugin name without
+    the 'builtin/' prefix.
+    """
+    options = dict(options or {})
+    plugins: list[PreloadPluginSpec] = []
+    for builtin in manifest():
+        plugin = builtin.spec
+        missing = [name for name in builtin.requires if not import_util.find_spec(name)]
+        short_name = plugin.name.removeprefix("builtin/")
+        if missing:
             log.debug(
-                f"load of [bright_blue]{target}[/] [yellow][bold]failed[/] "
-                f"because of an import error:[/] [italic]{e}[/]",
-                extra={"markup": True},
-            )
-        except Exception as e:
-            log.error(
-                f"load of [bright_blue]{target}[/] [bold red]failed[/] "
-                f"because of [red][bold]{type(e).__name__}[/]: [italic]{e}[/][/]",
+                f"[bright_blue]{plugin.name}[/] [yellow]unavailable[/]: "
+                f"[italic]{', '.join(missing)} not installed[/]",
                 extra={"markup": True},
             )
+            options.pop(short_name, None)
+            continue
+        plugin.module_name = import_util.resolve_name(builtin.module, __name__)
+        plugin.configure(options.pop(short_name, {}))
+        plugins.append(plugin)
+    for name in options:
+        log.warning(f"options given for unknown builtin plugin '{name}'")
     log.info(
         f"{len(plugins)} builtin plugins - {', '.join(map(lambda x: x.name, plugins[:8]))}"
     )
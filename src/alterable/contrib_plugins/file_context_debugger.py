@@ -2,21 +2,10 @@ import logging
 from pathlib import Path
 
 from .. import FileContext
-from ..plugins.structure import FilePluginPipelineInfo, PreloadPluginSpec
 
 log = logging.getLogger("file_ctx_dbg")
 
 
-def about() -> PreloadPluginSpec:
-    return PreloadPluginSpec(
-        name="builtin/file_ctx_dbg",
-        pipeline=FilePluginPipelineInfo("main", [r""]),
-        provides={"file_ctx_dbg", "builtin/file_ctx_dbg"},
-        use=[],
-        module=None,  # Will be filled by caller
-    )
-
-
 def main(target: Path, context: FileContext):
     builder = f"File context for [bold bright_blue]{target.name}[/]:\n"
     for prop in dir(context.data):
@@ -1,23 +1,57 @@
+"""
+Adds an 'html' property to HTML files: the document parsed with BeautifulSoup.
+
+The tree is parsed once per file and kept until the file changes. Plugins that
+edit it in place call context.mark_modified("html"); the document is written
+back to the file once, at the end of the step.
+
+Options (under builtins.parse_html in the configuration):
+    parser: a BeautifulSoup tree builder ('lxml', 'html5lib', 'html.parser'),
+        or 'auto' (the default) for the fastest one installed.
+"""
+
+import functools
 from pathlib import Path
 
 from bs4 import BeautifulSoup
+from bs4.builder import builder_registry
 
 from ..plugins.shared_context import BaseFileProps, FileContext
-from ..plugins.structure import FilePluginPipelineInfo, PreloadPluginSpec
 
+# fastest first
+_PREFERRED = ["lxml", "html.parser"]
+parser = "html.parser"
 
-def about() -> PreloadPluginSpec:
-    return PreloadPluginSpec(
-        name="builtin/parse_html",
-        pipeline=FilePluginPipelineInfo("main", [r".*\.html$"]),
-        provides={"parse_html", "builtin/parse_html"},
-        use=[],
-        module=None,  # Will be filled by caller
-    )
 
+def configure(options: dict):
+    global parser
+    choice = options.get("parser", "auto")
+    if choice == "auto":
+        parser = next(name for name in _PREFERRED if builder_registry.lookup(name))
+    elif builder_registry.lookup(choice) is None:
+        raise ValueError(f"HTML parser '{choice}' is not installed")
+    else:
+        parser = choice
 
-def main(target: Path, context: FileContext):
-    def lazy_parse(self_: BaseFileProps):
-        return BeautifulSoup(self_.content, "html.parser")
 
-    context.data.new_property("html", lazy_parse)
+def parse(props: BaseFileProps, parser: str) -> BeautifulSoup:
+    return BeautifulSoup(props.content, parser)
+
+
+def tree_size(props: BaseFileProps, _) -> int:
+    # a parsed tree takes roughly ten times the size of its source
+    return 10 * len(props.raw)
+
+
+def main(target: Path, context: FileContext):
+    # module-level functions, so that the property can be sent to worker
+    # processes (where configure() may not have run). Parsing again is
+    # quicker than pickling a tree, so trees stay in the process that made them.
+    context.data.new_property(
+        "html",
+        functools.partial(parse, parser=parser),
+        cached=True,
+        size=tree_size,
+        local=True,
+    )
+    context.write_back("html", str)
@@ -0,0 +1,207 @@
+"""
+A listing of every file in the sandbox, shared by all plugins in a run.
+
+The index is built with one walk. After that, refreshing it only stats the
+known directories: creating, renaming or deleting a file changes the mtime of
+the directory it's in, so only those directories get listed again.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+
+from .matcher import FileMatcher, extension_of
+
+# Directories modified this close to the moment they were listed might change
+# again without their mtime moving (timestamps are coarse), so list them again
+# on the next refresh.
+_RACY_NS = 50_000_000
+
+
+class FileIndex:
+    def __init__(self, root: Path):
+        self.root = root.absolute()
+        self.version = 0
+        # relative dir ("" for the root) -> mtime at listing, None if racy
+        self._stamps: dict[str, Optional[int]] = {}
+        self._files: dict[str, list[str]] = {}
+        self._children: dict[str, list[str]] = {}
+        self._entries: Optional[list[tuple[Path, str]]] = None
+        self._extensions: Optional[dict[str, list[tuple[Path, str]]]] = None
+        self._matches: dict[FileMatcher, list[Path]] = {}
+        self._lock = threading.RLock()
+        self._built = False
+
+    def _full(self, rel: str) -> str:
+        return os.path.join(self.root, rel) if rel else str(self.root)
+
+    def _list(self, rel: str):
+        """
+        List one directory, then any subdirectories not seen before.
+        """
+        pending = [rel]
+        changed = False
+        while pending:
+            at = pending.pop()
+            full = self._full(at)
+            try:
+                stamp: Optional[int] = os.stat(full).st_mtime_ns
+                files, children = [], []
+                with os.scandir(full) as it:
+                    for entry in it:
+                        if entry.is_dir():
+                            # like os.walk, don't descend into symlinked dirs
+                            if not entry.is_symlink():
+                                children.append(os.path.join(at, entry.name))
+                        else:
+                            files.append(entry.name)
+            except (FileNotFoundError, NotADirectoryError):
+                self._forget(at)
+                continue
+            if stamp is not None and stamp >= time.time_ns() - _RACY_NS:
+                stamp = None
+            self._stamps[at] = stamp
+            if at not in self._files or sorted(files) != sorted(self._files[at]):
+                self._files[at] = files
+                changed = True
+            for child in self._children.get(at, []):
+                if child not in children:
+                    self._forget(child)
+            self._children[at] = children
+            pending.extend(child for child in children if child not in self._stamps)
+        if changed:
+            self._changed()
+
+    def _forget(self, rel: str):
+        pending = [rel]
+        while pending:
+            at = pending.pop()
+            self._stamps.pop(at, None)
+            self._files.pop(at, None)
+            pending.extend(self._children.pop(at, []))
+        self._changed()
+
+    def _changed(self):
+        self._entries = None
+        self._extensions = None
+        self._matches.clear()
+        self.version += 1
+
+    def refresh(self):
+        """
+        Pick up changes made directly on disk since the last refresh.
+        """
+        with self._lock:
+            if not self._built:
+                self._list("")
+                self._built = True
+                return
+            stale = []
+            for rel, stamp in self._stamps.items():
+                try:
+                    current = os.stat(self._full(rel)).st_mtime_ns
+                except FileNotFoundError:
+                    current = None
+                if stamp is None or current != stamp:
+                    stale.append(rel)
+            for rel in stale:
+                if rel in self._stamps:
+                    self._list(rel)
+
+    def entries(self) -> list[tuple[Path, str]]:
+        """
+        (absolute path, sandbox-relative posix path) for every file,
+        refreshed first.
+        """
+        with self._lock:
+            self.refresh()
+            if self._entries is None:
+                entries = []
+                for rel, files in self._files.items():
+                    base = self.root / rel if rel else self.root
+                    prefix = Path(rel).as_posix() + "/" if rel else ""
+                    for name in files:
+                        entries.append((base / name, prefix + name))
+                self._entries = entries
+            return self._entries
+
+    def _by_extension(self) -> dict[str, list[tuple[Path, str]]]:
+        if self._extensions is None:
+            table: dict[str, list[tuple[Path, str]]] = {}
+            for entry in self.entries():
+                table.setdefault(extension_of(entry[1]), []).append(entry)
+            self._extensions = table
+        return self._extensions
+
+    def match(self, matcher: FileMatcher) -> list[Path]:
+        """
+        Files accepted by matcher. Results are kept until the index changes.
+        """
+        with self._lock:
+            entries = self.entries()
+            if matcher not in self._matches:
+                if matcher.extension_only:
+                    table = self._by_extension()
+                    found = [
+                        path
+                        for extension in dict.fromkeys(matcher.extensions)
+                        for path, _ in table.get(extension, [])
+                    ]
+                else:
+                    found = [path for path, rel in entries if matcher(rel)]
+                self._matches[matcher] = found
+            return self._matches[matcher]
+
+    def prime(self, matchers: Iterable[FileMatcher]):
+        """
+        Match several matchers in a single pass over the index.
+        """
+        with self._lock:
+            entries = self.entries()
+            todo = [
+                m
+                for m in dict.fromkeys(matchers)
+                if m not in self._matches and not m.extension_only
+            ]
+            if not todo:
+                return
+            results: list[list[Path]] = [[] for _ in todo]
+            for path, rel in entries:
+                for matcher, found in zip(todo, results):
+                    if matcher(rel):
+                        found.append(path)
+            self._matches.update(zip(todo, results))
+
+    def _split(self, path: Path) -> tuple[str, str]:
+        rel = os.path.relpath(Path(path).absolute(), self.root)
+        parent, name = os.path.split(rel)
+        return parent, name
+
+    def created(self, path: Path):
+        """
+        Record a file created by a plugin without waiting for a refresh.
+        """
+        with self._lock:
+            parent, name = self._split(path)
+            if parent not in self._files:
+                self._list(parent)
+                return
+            if name not in self._files[parent]:
+                self._files[parent].append(name)
+                self._changed()
+
+    def deleted(self, path: Path):
+        with self._lock:
+            parent, name = self._split(path)
+            if name in self._files.get(parent, []):
+                self._files[parent].remove(name)
+                self._changed()
+
+    def renamed(self, source: Path, target: Path):
+        with self._lock:
+            self.deleted(source)
+            self.created(target)
@@ -0,0 +1,92 @@
+"""
+Compiled 'match' rules for file pipelines.
+
+All of a plugin's rules are combined into one regex. Rules that only test a
+literal ending (like '.*\\.html$') are answered from the file index's
+extension table or with str.endswith, without running a regex at all.
+Rules are matched against sandbox-relative paths, with '/' as the separator.
+"""
+
+from __future__ import annotations
+
+import functools
+import re
+from typing import Optional
+
+# optional '^' and/or '.*', then only literal characters, then '$'
+_LITERAL_SUFFIX = re.compile(
+    r"^\^?(?:\.\*)?((?:\\[^A-Za-z0-9]|[^.^$*+?{}\[\]\\|()])+)\$$"
+)
+_UNESCAPE = re.compile(r"\\(.)")
+
+
+def literal_suffix(rule: str) -> Optional[str]:
+    """
+    The literal text a rule requires at the end of the path, if that is all
+    the rule checks.
+    """
+    found = _LITERAL_SUFFIX.match(rule)
+    if found is None:
+        return None
+    if rule.startswith("^") and not rule.startswith("^.*"):
+        return None  # anchored at both ends: a whole path, not a suffix
+    return _UNESCAPE.sub(r"\1", found.group(1))
+
+
+def extension_of(name: str) -> str:
+    """
+    Everything from the last '.' in the file name, or '' if there isn't one.
+    """
+    base = name.rsplit("/", 1)[-1]
+    dot = base.rfind(".")
+    return base[dot:] if dot >= 0 else ""
+
+
+class FileMatcher:
+    def __init__(self, rules: tuple[str, ...]):
+        self.rules = rules
+        self.everything = any(rule == "" for rule in rules)
+        # suffixes that are a plain extension, answered from the extension table
+        self.extensions: list[str] = []
+        # other literal suffixes, answered with endswith
+        self.suffixes: list[str] = []
+        remaining: list[str] = []
+        for rule in rules:
+            suffix = literal_suffix(rule)
+            if suffix is None:
+                remaining.append(rule)
+            elif suffix.startswith(".") and extension_of(suffix) == suffix:
+                self.extensions.append(suffix)
+            else:
+                self.suffixes.append(suffix)
+        self.patterns: list[re.Pattern] = []
+        if remaining:
+            try:
+                self.patterns = [
+                    re.compile("|".join(f"(?:{rule})" for rule in remaining))
+                ]
+            except re.error:
+                # e.g. global flags in the middle of the alternation
+                self.patterns = [re.compile(rule) for rule in remaining]
+
+    @property
+    def extension_only(self) -> bool:
+        return not self.everything and not self.suffixes and not self.patterns
+
+    def __call__(self, rel: str) -> bool:
+        if self.everything:
+            return True
+        if self.extensions and extension_of(rel) in self.extensions:
+            return True
+        for suffix in self.suffixes:
+            if rel.endswith(suffix):
+                return True
+        for pattern in self.patterns:
+            if pattern.search(rel):
+                return True
+        return False
+
+
+@functools.lru_cache(maxsize=None)
+def compile_rules(rules: tuple[str, ...]) -> FileMatcher:
+    return FileMatcher(rules)
@@ -7,20 +7,29 @@ files need to be processed.
 import functools
 import inspect
 import logging
-import os
-import re
 from pathlib import Path
-from typing import Any, Callable, Protocol, TypeVar
+from typing import Any, Callable, Optional, Protocol, TypeVar
 
+from .matcher import compile_rules
 from .shared_context import ProjectContext
-from .structure import FilePluginPipelineInfo, PluginPipelineInfo, PluginSpec
+from .structure import (
+    BatchPluginPipelineInfo,
+    FilePluginPipelineInfo,
+    PluginPipelineInfo,
+    PluginSpec,
+)
 
 Ret = TypeVar("Ret")
 log = logging.getLogger("plugins.prepare")
 
 
 def try_bind(target: Callable[..., Ret], args: int, kwargs: list[str] = None) -> bool:
-    kwargs = kwargs or []
+    return _try_bind(target, args, tuple(kwargs or []))
+
+
+# Entrypoints are checked once per function, not once per plugin and step
+@functools.lru_cache(maxsize=1024)
+def _try_bind(target: Callable[..., Ret], args: int, kwargs: tuple[str, ...]) -> bool:
     signature = inspect.signature(target)
     try:
         test_args = [None] * args
@@ -32,6 +41,7 @@ def try_bind(target: Callable[..., Ret], args: int, kwargs: list[str] = None) ->
 
 
 PipelineT = TypeVar("PipelineT", bound=PluginPipelineInfo)
+SelectT = Optional[Callable[[Path], bool]]
 
 
 class _PathInstanceProvider(Protocol):
@@ -41,6 +51,7 @@ class _PathInstanceProvider(Protocol):
         sandbox_base: Path,
         binding: Callable[..., None],
         context: ProjectContext,
+        select: SelectT = None,
     ) -> list[Callable[[], None]]: ...
 
 
@@ -53,8 +64,14 @@ def match_project(
     sandbox_base: Path,
     binding: Callable[..., None],
     context: ProjectContext,
+    select: SelectT = None,
 ) -> list[Callable[[], None]]:
     assert pipe_info.target == "project"
+    if try_bind(binding, 2, ["changed"]):
+        # Incremental-aware plugins get the set of changed files
+        return [
+            functools.partial(binding, sandbox_base, context, changed=context.changed)
+        ]
     return [functools.partial(binding, sandbox_base, context)]
 
 
@@ -63,23 +80,65 @@ def match_files(
     sandbox_base: Path,
     binding: Callable[..., None],
     context: ProjectContext,
+    select: SelectT = None,
 ) -> list[Callable[[], None]]:
     assert pipe_info.target == "file"
-    matching = []
-    patterns = [re.compile(pat) for pat in pipe_info.rules]
-    for dir_path, _, filenames in os.walk(sandbox_base):
-        for file in filenames:
-            full_path = Path(dir_path) / file
-            if any(map(lambda pattern: pattern.search(str(full_path)), patterns)):
-                matching.append(full_path)
     return [
-        functools.partial(binding, path, context.files[str(path)]) for path in matching
+        functools.partial(binding, path, context.files[str(path)])
+        for path in _matching(pipe_info, sandbox_base, context, select)
     ]
 
 
+def match_batch(
+    pipe_info: BatchPluginPipelineInfo,
+    sandbox_base: Path,
+    binding: Callable[..., None],
+    context: ProjectContext,
+    select: SelectT = None,
+) -> list[Callable[[], None]]:
+    assert pipe_info.target == "batch"
+    items = [
+        (path, context.files[str(path)])
+        for path in _matching(pipe_info, sandbox_base, context, select)
+    ]
+    return split_batch(binding, items, pipe_info.chunk or len(items))
+
+
+def split_batch(
+    binding: Callable[..., None], items: list[tuple[Path, Any]], size: int
+) -> list[Callable[[], None]]:
+    """
+    One binding per chunk of at most size (path, context) pairs.
+    """
+    return [
+        functools.partial(binding, items[start : start + size])
+        for start in range(0, len(items), max(size, 1))
+    ]
+
+
+def _matching(
+    pipe_info: FilePluginPipelineInfo,
+    sandbox_base: Path,
+    context: ProjectContext,
+    select: SelectT,
+) -> list[Path]:
+    matcher = compile_rules(tuple(pipe_info.rules))
+    matching = context.index(sandbox_base).match(matcher)
+    if select is not None:
+        matching = [path for path in matching if select(path)]
+    return matching
+
+
 def prepare(
-    plug: PluginSpec, sandbox_base: Path, context: ProjectContext
+    plug: PluginSpec,
+    sandbox_base: Path,
+    context: ProjectContext,
+    select: SelectT = None,
 ) -> list[Callable[[], Any]]:
+    """
+    Bindings (argument-less calls) that run the plugin. For file and batch
+    targets, select can narrow down which of the matching files to run on.
+    """
     try:
         module = plug.resolve()
     except FileNotFoundError as e:
@@ -98,6 +157,10 @@ def prepare(
     arg_specs = {
         "project": (lambda func: try_bind(func, 2), "(project_path, build_context)"),
         "file": (lambda func: try_bind(func, 2), "(file_path, build_context)"),
+        "batch": (
+            lambda func: try_bind(func, 1),
+            "(files), a sequence of (file_path, build_context) pairs",
+        ),
     }
     try:
         arg_spec, description = arg_specs[pipeline.target]
@@ -116,6 +179,7 @@ def prepare(
     list_builder: _PathInstanceProvider = {
         "project": match_project,
         "file": match_files,
+        "batch": match_batch,
     }[pipeline.target]
-    bindings = list_builder(pipeline, sandbox_base, entrypoint, context)  # type: ignore
+    bindings = list_builder(pipeline, sandbox_base, entrypoint, context, select)  # type: ignore
     return bindings
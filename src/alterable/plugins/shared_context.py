@@ -1,48 +1,437 @@
 from __future__ import annotations
 
+import contextlib
+import logging
+import mmap
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+from collections import Counter, OrderedDict
 from pathlib import Path
-from typing import Any, Callable, Self, TypeVar, cast
+from typing import (
+    Any,
+    Callable,
+    Hashable,
+    Iterable,
+    Optional,
+    Self,
+    TypeVar,
+    Union,
+    cast,
+)
+
+from . import transfer
+from .file_index import FileIndex
+from .transfer import FileState, SharedBytes
+
+log = logging.getLogger("context")
+
+
+class CacheStats:
+    """
+    Hit and miss counts for cached properties, by property name.
+    """
+
+    def __init__(self):
+        self.hits: Counter[str] = Counter()
+        self.misses: Counter[str] = Counter()
+
+    def hit(self, name: str):
+        self.hits[name] += 1
+
+    def miss(self, name: str):
+        self.misses[name] += 1
+
+    def summary(self) -> str:
+        names = sorted(self.hits.keys() | self.misses.keys())
+        return ", ".join(
+            f"{name} {self.hits[name]}/{self.hits[name] + self.misses[name]}"
+            for name in names
+        )
+
+
+SizeFn = Callable[[Any, Any], int]
+
+
+def approximate_size(value: Any) -> int:
+    if isinstance(value, memoryview):
+        return value.nbytes
+    return sys.getsizeof(value)
+
+
+class MemoryBudget:
+    """
+    Tracks cached property values across every file of a project, least
+    recently used first. When a limit is set and the total goes over it,
+    values are dropped; they are computed again by their provider the next
+    time they're read.
+    """
+
+    def __init__(self, limit: Optional[int] = None):
+        self.limit = limit
+        self.total = 0
+        self.evictions = 0
+        self._entries: OrderedDict[tuple[BaseProps, str], int] = OrderedDict()
+        # counted in the total, but never evicted
+        self._pinned: dict[tuple[BaseProps, str], int] = {}
+        self._lock = threading.RLock()
+
+    def add(self, props: BaseProps, name: str, size: int):
+        with self._lock:
+            key = (props, name)
+            if key in self._pinned:
+                self.total += size - self._pinned[key]
+                self._pinned[key] = size
+                return
+            self.total += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            self._shrink(key)
+
+    def _shrink(self, key: tuple[BaseProps, str]):
+        # with the lock held; key is the value just added
+        while self.limit is not None and self.total > self.limit and self._entries:
+            (victim, victim_name), _ = next(iter(self._entries.items()))
+            if (victim, victim_name) == key:
+                break  # never evict the value being returned
+            self.evictions += 1
+            victim._evict(victim_name)
+
+    def touch(self, props: BaseProps, name: str):
+        if self.limit is None:
+            return
+        with self._lock:
+            key = (props, name)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+
+    def discard(self, props: BaseProps, name: str):
+        with self._lock:
+            key = (props, name)
+            self.total -= self._entries.pop(key, 0) + self._pinned.pop(key, 0)
+
+    def pin(self, props: BaseProps, name: str):
+        """
+        Keep a value from being evicted until unpin, e.g. because it was
+        changed in place and isn't saved yet.
+        """
+        with self._lock:
+            key = (props, name)
+            if key in self._entries:
+                self._pinned[key] = self._entries.pop(key)
+
+    def unpin(self, props: BaseProps, name: str):
+        with self._lock:
+            key = (props, name)
+            if key in self._pinned:
+                self._entries[key] = self._pinned.pop(key)
+                self._shrink(key)
+
+    def report(self) -> dict[str, tuple[int, int]]:
+        """
+        Property name -> (number of cached values, approximate bytes).
+        """
+        with self._lock:
+            report: dict[str, tuple[int, int]] = {}
+            for (_, name), size in [*self._entries.items(), *self._pinned.items()]:
+                count, total = report.get(name, (0, 0))
+                report[name] = (count + 1, total + size)
+            return report
+
+
+class AutoProperty:
+    """
+    A read only property computed by provider(props) on access, declared on
+    a props class. With cached=True the value is kept like new_property's.
+    """
+
+    def __init__(
+        self,
+        provider: Callable[[Any], Any],
+        *,
+        cached: bool = False,
+        size: Optional[SizeFn] = None,
+    ):
+        self.provider = provider
+        self.cached = cached
+        self.size = size
+        self.name = ""
+
+    def __set_name__(self, owner: type, name: str):
+        self.name = name
+
+    def __get__(self, instance: Optional[BaseProps], owner: Optional[type] = None):
+        if instance is None:
+            return self
+        overrides = instance._auto_props
+        if self.name in overrides:
+            # replaced or deleted with new_property / del on this instance
+            provider = overrides[self.name]
+            if provider is None:
+                return _plain_value(instance, self.name)
+            return instance._get_auto(self.name, provider)
+        return instance._get_auto(self.name, self.provider, self.cached, self.size)
+
+    def __set__(self, instance: BaseProps, value: Any):
+        _set_if_plain(instance, self.name, value)
+
+
+class _InstanceProperty:
+    """
+    Slot for a property added to one instance with new_property. It lives on
+    a shared subclass (see _variant) and looks the provider up per instance.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __get__(self, instance: Optional[BaseProps], owner: Optional[type] = None):
+        if instance is None:
+            return self
+        provider = instance._auto_props.get(self.name)
+        if provider is None:
+            return _plain_value(instance, self.name)
+        return instance._get_auto(self.name, provider)
+
+    def __set__(self, instance: BaseProps, value: Any):
+        _set_if_plain(instance, self.name, value)
+
+
+def _plain_value(instance: BaseProps, name: str) -> Any:
+    # The property was deleted; it may have been replaced by a plain attribute
+    try:
+        return instance.__dict__[name]
+    except KeyError:
+        raise AttributeError(
+            f"{type(instance).__name__!r} object has no attribute {name!r}"
+        ) from None
+
+
+def _set_if_plain(instance: BaseProps, name: str, value: Any):
+    if instance._auto_props.get(name, _plain_value) is not None:
+        raise KeyError(f"{name} is a read only property")
+    instance.__dict__[name] = value
+
+
+class _Protected:
+    """
+    A method that can't be overwritten on instances.
+    """
+
+    def __init__(self, func: Callable):
+        self.func = func
+
+    def __set_name__(self, owner: type, name: str):
+        self.name = name
+
+    def __get__(self, instance: Any, owner: Optional[type] = None):
+        return self.func.__get__(instance, owner)
+
+    def __set__(self, instance: Any, value: Any):
+        raise KeyError(f"writing to {self.name} is not permitted")
+
+
+_variants: dict[tuple[type, frozenset[str]], type] = {}
+
+
+def _variant(base: type, names: frozenset[str]) -> type:
+    """
+    Subclass of base with a slot for each per-instance property name. Every
+    instance with the same set of names shares one subclass, so attribute
+    lookup stays on the interpreter's normal fast path.
+    """
+    key = (base, names)
+    if key not in _variants:
+        attrs: dict[str, Any] = {"__slots__": (), "_variant_of": base}
+        for name in names:
+            if name not in base._class_props:
+                attrs[name] = _InstanceProperty(name)
+        attrs["__module__"] = base.__module__
+        _variants.setdefault(key, type(base.__name__, (base,), attrs))
+    return _variants[key]
 
 
 class BaseProps:
     """
     Generic data storage. Used directly in ProjectContext.
     Extend this class to define dependencies.
+
+    Subclasses declare their properties with AutoProperty; new_property adds
+    more to a single instance. Plain attributes are stored normally, so
+    reading them costs the same as on any other object.
+
+    Properties created with cached=True are computed once and kept until
+    _stamp() changes or they are invalidated.
     """
 
-    def __init__(self):
-        self._auto_props: dict[str, Callable[[Self], Any]] = {}
-
-    def __getattribute__(self, item: str):
-        default = super().__getattribute__
-        PASSTHROUGH = ["new_property"]
-        if item not in PASSTHROUGH and item in default("_auto_props"):
-            return self._auto_props[item](self)
-        return default(item)
-
-    def __setattr__(self, key: str, value: Any):
-        default = super().__setattr__
-        PASSTHROUGH = ["_auto_props"]
-        if key in PASSTHROUGH:
-            return default(key, value)
-        PROTECTED = ["new_property", "__getattribute__", "__setattr__"]
-        if key in PROTECTED:
-            raise KeyError(f"writing to {key} is not permitted")
-        if key in self._auto_props:
-            raise KeyError(f"{key} is a read only property")
-        return default(key, value)
+    __slots__ = (
+        "_auto_props",
+        "_cached",
+        "_local_props",
+        "_cache",
+        "_stats",
+        "_budget",
+        "__dict__",
+    )
+    _class_props: dict[str, AutoProperty] = {}
+    _variant_of: Optional[type] = None
+    # cached properties not worth sending to another process
+    _local: frozenset[str] = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        props: dict[str, AutoProperty] = {}
+        for base in reversed(cls.__mro__):
+            for key, value in vars(base).items():
+                if isinstance(value, AutoProperty):
+                    props[key] = value
+        cls._class_props = props
+
+    def __init__(
+        self,
+        stats: Optional[CacheStats] = None,
+        budget: Optional[MemoryBudget] = None,
+    ):
+        # per-instance properties; None marks a deleted one
+        self._auto_props: dict[str, Optional[Callable[[Self], Any]]] = {}
+        # per-instance properties that are cached -> size estimator
+        self._cached: dict[str, Optional[SizeFn]] = {}
+        # per-instance properties not worth sending to another process
+        self._local_props: set[str] = set()
+        self._cache: dict[str, tuple[Hashable, Any]] = {}
+        self._stats = stats or CacheStats()
+        self._budget = budget
+
+    def _get_auto(
+        self,
+        item: str,
+        provider: Callable[[Self], Any],
+        cached: Optional[bool] = None,
+        size: Optional[SizeFn] = None,
+    ):
+        if cached is None:
+            cached = item in self._cached
+            size = self._cached.get(item)
+        if not cached:
+            return provider(self)
+        stamp = self._stamp()
+        entry = self._cache.get(item)
+        if entry is not None and entry[0] == stamp:
+            self._stats.hit(item)
+            if self._budget is not None:
+                self._budget.touch(self, item)
+            return entry[1]
+        self._stats.miss(item)
+        value = provider(self)
+        self._cache[item] = (stamp, value)
+        if self._budget is not None:
+            weight = size(self, value) if size is not None else None
+            self._budget.add(self, item, weight or approximate_size(value))
+        return value
+
+    def _evict(self, name: str):
+        """
+        Drop a cached value to free memory. Subclasses release anything
+        else tied to it.
+        """
+        self._drop(name)
+
+    def _drop(self, name: str):
+        if self._cache.pop(name, None) is not None and self._budget is not None:
+            self._budget.discard(self, name)
+
+    def _stamp(self) -> Hashable:
+        """
+        Cached values computed under a different stamp are stale.
+        """
+        return None
+
+    def _adopt(self, name: str, value: Any):
+        """
+        Cache a value for the current stamp that was computed somewhere else
+        (in a worker process).
+        """
+        declared = type(self)._class_props.get(name)
+        if name in self._cached:
+            size = self._cached[name]
+        elif declared is not None and declared.cached and name not in self._auto_props:
+            size = declared.size
+        else:
+            return  # not a cached property here
+        self._drop(name)
+        self._cache[name] = (self._stamp(), value)
+        if self._budget is not None:
+            weight = size(self, value) if size is not None else None
+            self._budget.add(self, name, weight or approximate_size(value))
+
+    @_Protected
+    def invalidate(self, *names: str):
+        """
+        Drop cached values (all of them if no names are given).
+        """
+        for name in names or list(self._cache):
+            self._drop(name)
 
     def __delattr__(self, item: str):
-        default = super().__delattr__
-        if item in self._auto_props:
-            del self._auto_props[item]
-            del self.__dict__[item]
+        is_auto = item in type(self)._class_props or item in self._auto_props
+        if is_auto and self._auto_props.get(item, _plain_value) is not None:
+            self._auto_props[item] = None
+            self._cached.pop(item, None)
+            self._drop(item)
             return
-        return default(item)
+        return object.__delattr__(self, item)
+
+    def __dir__(self):
+        hidden = {k for k, v in self._auto_props.items() if v is None}
+        hidden -= self.__dict__.keys()
+        return sorted(set(super().__dir__()) - hidden)
+
+    @_Protected
+    def new_property(
+        self,
+        target: str,
+        provider: Callable[[Self], Any],
+        *,
+        cached: bool = False,
+        size: Optional[SizeFn] = None,
+        local: bool = False,
+    ):
+        """
+        Add a property to this instance. size(props, value) can estimate the
+        memory a cached value uses when sys.getsizeof would be misleading.
+        With local, a cached value is never sent to another process (like a
+        worker's results back to the runner): for values that are quicker
+        to compute again than to pickle.
+        """
+        self.__dict__.pop(target, None)
+        self._auto_props[target] = cast(Callable[[Self], Any], provider)
+        self._drop(target)
+        if cached:
+            self._cached[target] = size
+        else:
+            self._cached.pop(target, None)
+        if local:
+            self._local_props.add(target)
+        else:
+            self._local_props.discard(target)
+        cls = type(self)
+        if not isinstance(
+            getattr(cls, target, None), (AutoProperty, _InstanceProperty)
+        ):
+            base = cls._variant_of or cls
+            names = frozenset(
+                name for name in self._auto_props if name not in base._class_props
+            )
+            object.__setattr__(self, "__class__", _variant(base, names))
 
-    def new_property(self, target: str, provider: Callable[[Self], Any]):
-        self.__dict__[target] = None
-        self._auto_props[target] = cast(provider, Callable[[Self], Any])
+
+def _read_bytes(props: BaseFileProps) -> bytes:
+    if props._pending is not None:
+        return props._pending
+    with open(props.fullpath, "rb") as f:
+        return f.read()
 
 
 class BaseFileProps(BaseProps):
@@ -51,18 +440,91 @@ class BaseFileProps(BaseProps):
     Provides basic file information.
     """
 
-    def __init__(self, fullpath: Path):
-        super().__init__()
+    __slots__ = ("fullpath", "name", "_maps", "_pending", "_writes")
+    # reading the file again is as fast as receiving them
+    _local = frozenset({"raw", "content", "buffer"})
+
+    exists = AutoProperty(
+        lambda self: self._pending is not None or self.fullpath.exists()
+    )
+    raw = AutoProperty(_read_bytes, cached=True)
+    # not through raw: a plugin may delete or replace that
+    content = AutoProperty(lambda self: _read_bytes(self).decode("utf-8"), cached=True)
+    buffer = AutoProperty(lambda self: self._map(), cached=True)
+
+    def __init__(
+        self,
+        fullpath: Path,
+        stats: Optional[CacheStats] = None,
+        budget: Optional[MemoryBudget] = None,
+    ):
+        super().__init__(stats, budget)
         self.fullpath = fullpath
         self.name = self.fullpath.name
-        self.new_property("exists", lambda _: self.fullpath.exists())
+        self._maps: list[tuple[mmap.mmap, memoryview]] = []
+        # content written with FileContext.write that isn't on disk yet
+        self._pending: Optional[bytes] = None
+        self._writes = 0
 
-        def read_bytes() -> bytes:
-            with open(self.fullpath, "rb") as f:
-                return f.read()
+    def _map(self) -> memoryview:
+        """
+        Read-only view of the file through mmap, without copying it into memory.
+        The file must not be truncated in place while a view is in use;
+        replacing it (write to a temporary file, then rename) is safe.
+        """
+        self.release()
+        if self._pending is not None:
+            return memoryview(self._pending)
+        with open(self.fullpath, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return memoryview(b"")  # can't map an empty file
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        self._maps.append((mapped, view))
+        return view
 
-        self.new_property("raw", lambda _: read_bytes())
-        self.new_property("content", lambda _: read_bytes().decode("utf-8"))
+    def _evict(self, name: str):
+        super()._evict(name)
+        if name == "buffer":
+            # a plugin may still be reading the old view, so leave unmapping
+            # to the garbage collector
+            self._maps = []
+
+    def release(self):
+        """
+        Unmap buffers handed out by 'buffer'. Maps that plugins still hold
+        slices of are left for the garbage collector.
+        """
+        maps, self._maps = self._maps, []
+        self.invalidate("buffer")
+        for mapped, view in maps:
+            view.release()
+            try:
+                mapped.close()
+            except BufferError:
+                log.debug(f"buffer for {self.fullpath} still in use, not unmapped")
+
+    def _rewritten(self, *keep: str):
+        """
+        The content was just replaced with one made from the cached values of
+        keep. Those are still valid for it; every other cached value is dropped.
+        """
+        stamp = self._stamp()
+        for name in list(self._cache):
+            if name in keep:
+                self._cache[name] = (stamp, self._cache[name][1])
+            else:
+                self._evict(name)
+
+    def _stamp(self) -> Hashable:
+        if self._pending is not None:
+            return "written", self._writes
+        # Changes to the file on disk make cached values stale
+        try:
+            st = os.stat(self.fullpath)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
 
 
 ddK = TypeVar("ddK")
@@ -75,18 +537,347 @@ class CtxDefaultDict(dict[ddK, ddV]):
         self.provider = provider
 
     def __missing__(self, key: str):
-        self[key] = value = self.provider(key)
-        return value
+        # setdefault keeps the first value if another thread got here first
+        return self.setdefault(key, self.provider(key))
+
+
+def replace_file(path: Path, content: Union[str, bytes]):
+    """
+    Write a file through a temporary file and a rename, so that readers
+    (and memory maps) never see it half-written.
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        with contextlib.suppress(FileNotFoundError):
+            shutil.copymode(path, tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp)
+        raise
+
+
+class WriteBuffer:
+    """
+    Files written with FileContext.write that are only in memory so far.
+    They are saved together by flush(), which the runner calls between steps,
+    or as soon as they add up to more than limit bytes.
+    """
+
+    def __init__(self, limit: Optional[int] = None):
+        self.limit = limit
+        self.pending = 0
+        self.written = 0
+        self._dirty: dict[BaseFileProps, int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, props: BaseFileProps, content: bytes):
+        with self._lock:
+            props._pending = content
+            props._writes += 1
+            self.pending += len(content) - self._dirty.get(props, 0)
+            self._dirty[props] = len(content)
+            full = self.limit is not None and self.pending > self.limit
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+            self.pending = 0
+        for props in dirty:
+            content = props._pending
+            if content is None:
+                continue
+            replace_file(props.fullpath, content)
+            with self._lock:
+                # unless it was written again in the meantime
+                if props._pending is content:
+                    props._pending = None
+                    # cached values came from this content, keep them
+                    props._rewritten(*props._cache)
+            self.written += 1
+
+    def discard(self, props: BaseFileProps):
+        """
+        Forget unsaved content of a file that was saved some other way.
+        """
+        with self._lock:
+            self.pending -= self._dirty.pop(props, 0)
+            props._pending = None
 
 
 class FileContext:
-    def __init__(self, path: Path):
-        self.data = BaseFileProps(path)
+    def __init__(
+        self,
+        path: Path,
+        stats: Optional[CacheStats] = None,
+        budget: Optional[MemoryBudget] = None,
+        writes: Optional[WriteBuffer] = None,
+    ):
+        self.data = BaseFileProps(path, stats, budget)
+        self.writes = writes or WriteBuffer()
+        # property name -> function turning its value back into file content
+        self.writers: dict[str, Callable[[Any], Union[str, bytes]]] = {}
+        self._modified: set[str] = set()
+        # for restored contexts: the write count, cached values and attributes
+        # received, which don't need to be sent back
+        self._received: tuple[int, dict[str, Any], dict[str, Any]] = (-1, {}, {})
+
+    def write(self, content: Union[str, bytes], *, keep: Iterable[str] = ()):
+        """
+        Replace the file's content. Plugins reading the file through this
+        context see the new content right away; it's saved to disk when the
+        runner flushes writes. Cached properties are dropped, except those
+        in keep, which the caller vouches for.
+        """
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        self.writes.add(self.data, content)
+        self.data._rewritten(*keep)
+
+    def flush(self):
+        """
+        Save pending writes (of every file sharing this context's buffer).
+        """
+        self.writes.flush()
+
+    def write_back(self, name: str, writer: Callable[[Any], Union[str, bytes]]):
+        """
+        Allow plugins to change the value of a cached property in place (like
+        a parsed document) and have it saved to the file at the end of the step.
+        """
+        self.writers[name] = writer
+
+    def mark_modified(self, name: str):
+        """
+        Note that the value of a property was changed in place.
+        """
+        if name not in self.writers:
+            raise KeyError(f"{name} can't be written back to {self.data.name}")
+        if self.data._budget is not None:
+            # evicting the value now would lose the change
+            self.data._budget.pin(self.data, name)
+        self._modified.add(name)
+
+    def end_step(self):
+        """
+        Write modified properties back to the file, once, however many plugins
+        of the step changed them.
+        """
+        if not self._modified:
+            return
+        modified, self._modified = self._modified, set()
+        try:
+            if len(modified) > 1:
+                raise RuntimeError(
+                    f"{self.data.name}: {', '.join(sorted(modified))} were all "
+                    "modified, only one of them can be written back"
+                )
+            name = next(iter(modified))
+            self.write(self.writers[name](getattr(self.data, name)), keep=[name])
+        finally:
+            if self.data._budget is not None:
+                for name in modified:
+                    self.data._budget.unpin(self.data, name)
+
+    def close(self):
+        """
+        Release OS resources (memory maps) held by this file's properties.
+        """
+        self.data.release()
+
+    def export(
+        self,
+        shared: Optional[list[SharedBytes]] = None,
+        *,
+        values: Optional[Iterable[str]] = None,
+    ) -> FileState:
+        """
+        This context as plain data, for another process. Per-instance
+        properties are sent by reference, so only those whose providers are
+        importable (module-level functions, or partials of them) make it;
+        cached values (all of them, or those named in values) are sent if
+        they're still valid and can be pickled. Leaving them out is often
+        cheaper: the other side computes what it reads again. With shared,
+        large payloads go through shared memory blocks, which are added to
+        it for the caller to release.
+
+        A restored context leaves out the content, cached values and
+        attributes it received, unless they changed.
+        """
+        data = self.data
+        received_writes, received, received_attrs = self._received
+        wanted = None if values is None else set(values)
+        stamp = data._stamp()
+        name = data.fullpath.name
+        providers: dict[str, Optional[tuple[Any, bool, Any, bool]]] = {}
+        for prop, provider in data._auto_props.items():
+            spec = None
+            if provider is not None:
+                spec = (
+                    provider,
+                    prop in data._cached,
+                    data._cached.get(prop),
+                    prop in data._local_props,
+                )
+            if transfer.dumps(spec, f"{name}: {prop} provider") is not None:
+                providers[prop] = spec
+        cache = {}
+        for prop, (entry_stamp, value) in list(data._cache.items()):
+            if entry_stamp != stamp or prop in data._local:
+                continue
+            if prop in data._local_props:
+                continue  # quicker to compute again than to send
+            if wanted is not None and prop not in wanted:
+                continue
+            if prop in data._auto_props and prop not in providers:
+                continue  # the other side couldn't recompute it
+            if received.get(prop, _plain_value) is value:
+                continue
+            pickled = transfer.dumps(value, f"{name}: {prop}")
+            if pickled is not None:
+                cache[prop] = transfer.pack(pickled, shared)
+        return FileState(
+            path=str(data.fullpath),
+            pending=(
+                transfer.pack(data._pending, shared)
+                if data._pending is not None and data._writes != received_writes
+                else None
+            ),
+            writes=data._writes,
+            attrs={
+                key: value
+                for key, value in data.__dict__.items()
+                if received_attrs.get(key, _plain_value) is not value
+                and transfer.dumps(value, f"{name}: {key}") is not None
+            },
+            providers=providers,
+            cache=cache,
+            writers={
+                prop: writer
+                for prop, writer in self.writers.items()
+                if transfer.dumps(writer, f"{name}: {prop} writer") is not None
+            },
+            hits=dict(data._stats.hits),
+            misses=dict(data._stats.misses),
+        )
+
+    @classmethod
+    def restore(cls, state: FileState) -> FileContext:
+        """
+        A new context from an exported one, with its own statistics and
+        write buffer. Nothing written through it is saved until it's flushed.
+        """
+        context = cls(Path(state.path))
+        context.data._pending = (
+            transfer.unpack(state.pending) if state.pending is not None else None
+        )
+        context.data._writes = state.writes
+        values = context._apply(state, unlink=False)
+        context._received = (state.writes, values, dict(state.attrs))
+        return context
+
+    def merge(self, state: FileState, sent: FileState):
+        """
+        Take in what was done to this file in another process: sent is what
+        went there, state is what came back. Shared memory blocks in state
+        are freed.
+        """
+        if state.writes != sent.writes:
+            if state.pending is not None:
+                self.write(transfer.unpack(state.pending, unlink=True))
+            else:
+                # written and saved over there
+                self.writes.discard(self.data)
+                self.data._rewritten()
+        # restored contexts count from zero
+        self.data._stats.hits.update(state.hits)
+        self.data._stats.misses.update(state.misses)
+        self._apply(state, unlink=True)
+
+    def _apply(self, state: FileState, *, unlink: bool) -> dict[str, Any]:
+        """
+        Take in the properties and values of state. Returns the values.
+        """
+        data = self.data
+        data.__dict__.update(state.attrs)
+        for prop, spec in state.providers.items():
+            if spec is None:
+                if data._auto_props.get(prop, _plain_value) is not None:
+                    delattr(data, prop)
+            elif data._auto_props.get(prop) is None:
+                provider, cached, size, local = spec
+                data.new_property(prop, provider, cached=cached, size=size, local=local)
+        values = {
+            prop: pickle.loads(transfer.unpack(payload, unlink=unlink))
+            for prop, payload in state.cache.items()
+        }
+        for prop, value in values.items():
+            data._adopt(prop, value)
+        self.writers.update(state.writers)
+        return values
+
+    def __reduce__(self):
+        # the props' class may be a variant made at runtime, which pickle
+        # can't find by name
+        return FileContext.restore, (self.export(),)
 
 
 class ProjectContext:
-    def __init__(self):
+    def __init__(
+        self,
+        memory_budget: Optional[int] = None,
+        write_buffer: Optional[int] = None,
+    ):
+        """
+        memory_budget: bytes of cached file properties to keep before the
+        least recently used ones are dropped; None for no limit.
+        write_buffer: bytes of written files to hold in memory before saving
+        them; None to wait for the runner.
+        """
         self.data = BaseProps()
+        # Files added, changed or removed since the last build; None if unknown
+        self.changed: Optional[set[Path]] = None
+        self.cache_stats = CacheStats()
+        self.memory = MemoryBudget(memory_budget)
+        self.writes = WriteBuffer(write_buffer)
         self.files: CtxDefaultDict[str, FileContext] = CtxDefaultDict(
-            lambda k: FileContext(Path(k).absolute())
+            lambda k: FileContext(
+                Path(k).absolute(), self.cache_stats, self.memory, self.writes
+            )
         )
+        self._indexes: dict[Path, FileIndex] = {}
+
+    def index(self, root: Path) -> FileIndex:
+        """
+        The shared file index for a sandbox. Plugins that create, rename or
+        delete files can tell it directly; anything else is picked up on the
+        next refresh.
+        """
+        root = root.absolute()
+        if root not in self._indexes:
+            self._indexes.setdefault(root, FileIndex(root))
+        return self._indexes[root]
+
+    def end_step(self):
+        """
+        Called by the runner after each step.
+        """
+        for file in list(self.files.values()):
+            file.end_step()
+
+    def flush(self):
+        """
+        Save every file written through a FileContext.
+        """
+        self.writes.flush()
+
+    def close(self):
+        for file in list(self.files.values()):
+            file.close()
@@ -1,27 +1,90 @@
 from __future__ import annotations
 
+import importlib
 import importlib.util as import_util
 import logging
+import os
 import sys
+import threading
 from hashlib import sha256
 from types import ModuleType
-from typing import Optional
-
-from strictyaml import Seq, Str, Validator
+from typing import TYPE_CHECKING, Any, Optional
 
 from alterable.util import mk_stop
 
+if TYPE_CHECKING:
+    from strictyaml import Validator
+
 log = logging.getLogger("core.plugin")
 stop = mk_stop(log)
 
 
 class PluginData(object):
     PIPELINE_TARGET = "target"
-    PIPELINE_TARGET_VALID = ["file", "project"]
-    RULES: dict[str, dict[str, Validator]] = {
-        "file": {"match": Seq(Str())},
-        "project": {},
-    }
+    PIPELINE_TARGET_VALID = ["file", "project", "batch"]
+    EXECUTORS = ["serial", "thread", "process"]
+
+    @staticmethod
+    def rules(target: str) -> dict[str, Validator]:
+        """
+        Pipeline keys each target needs on top of 'target' and 'entrypoint'.
+        Built on demand so that only loading a configuration imports strictyaml.
+        """
+        from strictyaml import Int
+        from strictyaml import Optional as Opt
+        from strictyaml import Seq, Str
+
+        return {
+            "file": {"match": Seq(Str())},
+            "project": {},
+            # chunk: files per call (default: all of them, split between
+            # workers when the plugin runs on a pool)
+            "batch": {"match": Seq(Str()), Opt("chunk"): Int()},
+        }[target]
+
+
+class PluginRunnerInfo:
+    """
+    Per-plugin execution overrides. Unset values fall back to the global
+    'runner' options. 'ordered' plugins never run alongside other plugins.
+    Turn 'incremental' off for file plugins that must see every file on every
+    run, e.g. because they attach properties to the context. 'concurrency'
+    limits how many calls of an async entrypoint are awaited at once.
+    """
+
+    def __init__(
+        self,
+        *,
+        executor: Optional[str] = None,
+        workers: Optional[int] = None,
+        ordered: bool = False,
+        incremental: bool = True,
+        concurrency: Optional[int] = None,
+    ):
+        self.executor = executor
+        self.workers = workers
+        self.ordered = ordered
+        self.incremental = incremental
+        self.concurrency = concurrency
+
+    @classmethod
+    def load(cls, template: dict, *, ordered: bool = False):
+        executor = template.get("executor")
+        if executor is not None and executor not in PluginData.EXECUTORS:
+            raise ValueError(f"unknown executor: {executor}")
+        workers = template.get("workers")
+        if workers is not None and workers < 1:
+            raise ValueError(f"workers must be at least 1 (got {workers})")
+        concurrency = template.get("concurrency")
+        if concurrency is not None and concurrency < 1:
+            raise ValueError(f"concurrency must be at least 1 (got {concurrency})")
+        return cls(
+            executor=executor,
+            workers=workers,
+            ordered=ordered,
+            incremental=template.get("incremental", True),
+            concurrency=concurrency,
+        )
 
 
 class PluginPipelineInfo:
@@ -36,6 +99,13 @@ class PluginPipelineInfo:
                 return ProjectPluginPipelineInfo(template["entrypoint"])
             case "file":
                 return FilePluginPipelineInfo(template["entrypoint"], template["match"])
+            case "batch":
+                chunk = template.get("chunk")
+                if chunk is not None and chunk < 1:
+                    raise ValueError(f"chunk must be at least 1 (got {chunk})")
+                return BatchPluginPipelineInfo(
+                    template["entrypoint"], template["match"], chunk
+                )
             case _ as bad:
                 raise ValueError(f"unknown pipeline target: {bad}")
 
@@ -55,6 +125,18 @@ class FilePluginPipelineInfo(PluginPipelineInfo):
         self.rules = rules
 
 
+class BatchPluginPipelineInfo(FilePluginPipelineInfo):
+    """
+    Matches files like a file target, but hands them to the entrypoint in
+    chunks: one call per sequence of (path, FileContext) pairs.
+    """
+
+    def __init__(self, entrypoint: str, rules: list[str], chunk: Optional[int] = None):
+        super().__init__(entrypoint, rules)
+        self.target = "batch"
+        self.chunk = chunk
+
+
 class PluginSpec:
     def __init__(
         self,
@@ -63,11 +145,13 @@ class PluginSpec:
         provides: set[str],
         use: list[str],
         pipeline: PluginPipelineInfo,
+        runner: Optional[PluginRunnerInfo] = None,
     ):
         self.use = use
         self.provides = provides
         self.name = name
         self.pipeline = pipeline
+        self.runner = runner or PluginRunnerInfo()
 
     def resolve(self) -> ModuleType:
         raise NotImplementedError("can't call resolve(): abstract on PluginSpec")
@@ -77,6 +161,11 @@ class PluginSpec:
 
 
 class PreloadPluginSpec(PluginSpec):
+    """
+    A plugin that is part of an importable package, like the builtins. With
+    module_name instead of module, the module is imported on first resolve().
+    """
+
     def __init__(
         self,
         name: str,
@@ -85,19 +174,74 @@ class PreloadPluginSpec(PluginSpec):
         use: list[str],
         pipeline: PluginPipelineInfo,
         module: Optional[ModuleType] = None,
+        module_name: Optional[str] = None,
+        runner: Optional[PluginRunnerInfo] = None,
     ):
-        super().__init__(name=name, provides=provides, use=use, pipeline=pipeline)
+        super().__init__(
+            name=name, provides=provides, use=use, pipeline=pipeline, runner=runner
+        )
         self.module = module
+        self.module_name = module.__name__ if module is not None else module_name
+        # from the 'builtins' section of the configuration
+        self.options: dict[str, Any] = {}
+        self._lock = threading.Lock()
 
-    def resolve(self) -> ModuleType:
+    def configure(self, options: dict[str, Any]):
+        """
+        Pass options to the module, if it takes any. Applied when the module
+        is imported if it hasn't been yet.
+        """
+        self.options = options
         if self.module is None:
-            raise ValueError(
-                "attempt to resolve badly formed (no module) PreloadPluginSpec"
-            )
-        return self.module
+            return
+        configure = getattr(self.module, "configure", None)
+        if configure is not None:
+            configure(options)
+        elif options:
+            raise ValueError(f"{self.name} doesn't take any options")
+
+    def resolve(self) -> ModuleType:
+        with self._lock:
+            if self.module is None:
+                if self.module_name is None:
+                    raise ValueError(
+                        "attempt to resolve badly formed (no module) PreloadPluginSpec"
+                    )
+                log.debug("Importing %s for %s", self.module_name, self.name)
+                self.module = importlib.import_module(self.module_name)
+                self.configure(self.options)
+            return self.module
+
+    def source(self) -> Optional[str]:
+        """
+        Path of the module's source file, without importing it.
+        """
+        if self.module is not None:
+            return getattr(self.module, "__file__", None)
+        if self.module_name is None:
+            return None
+        spec = import_util.find_spec(self.module_name)
+        return spec.origin if spec is not None else None
+
+    def __getstate__(self):
+        # Modules don't pickle; builtins are importable, so the worker
+        # imports the module again from module_name.
+        state = self.__dict__.copy()
+        state["module"] = None
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
 
     def __repr__(self):
-        return f'<PreloadPlugin {self.name} -> {self.module.__name__ if self.module is not None else "unbound!"}>'
+        return f'<PreloadPlugin {self.name} -> {self.module_name or "unbound!"}>'
+
+
+# real path -> ((real path, mtime, size) when loaded, module)
+_module_cache: dict[str, tuple[tuple[str, int, int], ModuleType]] = {}
+_module_lock = threading.Lock()
 
 
 class UserPluginSpec(PluginSpec):
@@ -109,8 +253,11 @@ class UserPluginSpec(PluginSpec):
         use: list[str],
         pipeline: PluginPipelineInfo,
         path: str,
+        runner: Optional[PluginRunnerInfo] = None,
     ):
-        super().__init__(name, provides=provides, use=use, pipeline=pipeline)
+        super().__init__(
+            name, provides=provides, use=use, pipeline=pipeline, runner=runner
+        )
         self.path = path
 
     @classmethod
@@ -143,25 +290,57 @@ class UserPluginSpec(PluginSpec):
             stop(
                 f"While loading plugin {name} info: 'pipeline' is not table (actually {pipeline_data=})"
             )
+        runner_data = template.get("runner", {})
+        if not isinstance(runner_data, dict):
+            stop(
+                f"While loading plugin {name} info: 'runner' is not table (actually {runner_data=})"
+            )
+        try:
+            pipeline = PluginPipelineInfo.load(pipeline_data)
+            runner = PluginRunnerInfo.load(
+                runner_data, ordered=template.get("ordered", False)
+            )
+        except KeyError as e:
+            stop(f"While loading plugin {name} info: 'pipeline' has no {e}")
+        except ValueError as e:
+            stop(f"While loading plugin {name} info: {e}")
         return cls(
             name=name,
             provides=provide_lst,
             use=use,
             path=path,
-            pipeline=PluginPipelineInfo.load(pipeline_data),
+            pipeline=pipeline,
+            runner=runner,
         )
 
     def resolve(self) -> ModuleType:
-        hash_name = sha256(self.name.encode()).hexdigest()
-        full_name = f"_alter_generated.plugins.{hash_name}"
-        import_spec = import_util.spec_from_file_location(full_name, self.path)
-        if import_spec is None:
-            log.error("Cannot load a plugin from %s", self.path)
-            raise ImportError(f"cannot load a plugin from {self.path}")
-        module = import_util.module_from_spec(import_spec)
-        sys.modules[full_name] = module
-        import_spec.loader.exec_module(module)
-        return module
+        """
+        Load the plugin's source file. Plugins sharing a file share the
+        module, which is only executed again if the file changes.
+        """
+        path = os.path.realpath(self.path)
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size)
+        with _module_lock:
+            module = _module_cache.get(path)
+            if module is not None and module[0] == key:
+                return module[1]
+            hash_name = sha256(path.encode()).hexdigest()
+            full_name = f"_alter_generated.plugins.{hash_name}"
+            # the source loader keeps compiled bytecode in __pycache__
+            import_spec = import_util.spec_from_file_location(full_name, path)
+            if import_spec is None or import_spec.loader is None:
+                log.error("Cannot load a plugin from %s", self.path)
+                raise ImportError(f"cannot load a plugin from {self.path}")
+            module = import_util.module_from_spec(import_spec)
+            sys.modules[full_name] = module
+            try:
+                import_spec.loader.exec_module(module)
+            except BaseException:
+                del sys.modules[full_name]
+                raise
+            _module_cache[path] = (key, module)
+            return module
 
     def __repr__(self):
         return f"<UserPlugin {self.name} -> {self.path}>"
@@ -0,0 +1,131 @@
+"""
+Sending file contexts to worker processes and back (see FileContext.export).
+
+Contexts travel as a FileState: plain data only. Large byte payloads (written
+content, pickled property values) go through a shared memory block instead of
+the pickle stream, which would copy them through a pipe.
+"""
+
+import logging
+import os
+import pickle
+from typing import Any, NamedTuple, Optional, Union
+
+log = logging.getLogger("context.transfer")
+
+# payloads at least this large go through shared memory
+SHARED_THRESHOLD = 64 * 1024
+
+
+def share_tracker():
+    """
+    Start this process's resource tracker, so that worker processes started
+    from now on use it too, instead of each starting their own.
+    """
+    if os.name == "posix":
+        from multiprocessing import resource_tracker
+
+        resource_tracker.ensure_running()
+
+
+class SharedBytes:
+    """
+    Bytes in a shared memory block. Only the block's name is pickled. The
+    creator either release()s the block once the receiver is done with it,
+    or hand_over()s it so that the receiver's take(unlink=True) frees it.
+
+    Pool workers share their parent's resource tracker (see share_tracker),
+    which forgets a block when it's unlinked: that must happen exactly once,
+    on either side.
+    """
+
+    def __init__(self, data: bytes):
+        from multiprocessing import shared_memory
+
+        self.size = len(data)
+        self._block = shared_memory.SharedMemory(create=True, size=max(self.size, 1))
+        self._block.buf[: self.size] = data
+        self.name = self._block.name
+
+    def __getstate__(self):
+        return {"name": self.name, "size": self.size}
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._block = None
+
+    def take(self, *, unlink: bool = False) -> bytes:
+        """
+        Copy the data out (in the receiving process).
+        """
+        from multiprocessing import shared_memory
+
+        block = shared_memory.SharedMemory(name=self.name)
+        try:
+            return bytes(block.buf[: self.size])
+        finally:
+            block.close()
+            if unlink:
+                block.unlink()
+
+    def release(self):
+        if self._block is not None:
+            self._block.close()
+            self._block.unlink()
+            self._block = None
+
+    def hand_over(self):
+        if self._block is not None:
+            self._block.close()
+            self._block = None
+
+
+PayloadT = Union[bytes, SharedBytes]
+
+
+def pack(data: bytes, shared: Optional[list[SharedBytes]]) -> PayloadT:
+    """
+    data, or a shared memory copy of it (added to shared) if it is large.
+    Without shared, and where shared memory outlives no handle (Windows),
+    the data is pickled as usual.
+    """
+    if shared is None or len(data) < SHARED_THRESHOLD or os.name != "posix":
+        return data
+    block = SharedBytes(data)
+    shared.append(block)
+    return block
+
+
+def unpack(payload: PayloadT, *, unlink: bool = False) -> bytes:
+    if isinstance(payload, SharedBytes):
+        return payload.take(unlink=unlink)
+    return payload
+
+
+def dumps(value: Any, what: str) -> Optional[bytes]:
+    """
+    value pickled, or None (with a note in the debug log) if it can't be.
+    """
+    try:
+        return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        log.debug(f"not sending {what}: {type(e).__name__}: {e}")
+        return None
+
+
+class FileState(NamedTuple):
+    path: str
+    # content written but not saved yet, and how many writes made it
+    pending: Optional[PayloadT]
+    writes: int
+    # plain attributes set on the props
+    attrs: dict[str, Any]
+    # per-instance properties: name -> (provider, cached, size, local), or
+    # None for a deleted one
+    providers: dict[str, Optional[tuple[Any, bool, Any, bool]]]
+    # cached values that are valid for the current content, pickled
+    cache: dict[str, PayloadT]
+    writers: dict[str, Any]
+    # cache hits and misses, by property name
+    hits: dict[str, int]
+    misses: dict[str, int]
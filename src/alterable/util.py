@@ -1,4 +1,6 @@
 import logging
+import os
+from pathlib import Path
 from typing import NoReturn, Protocol
 
 
@@ -12,3 +14,18 @@ def mk_stop(log: logging.Logger) -> StopProtocol:
         exit(1)
 
     return stop
+
+
+def cache_dir() -> Path:
+    """
+    Where alterable keeps state between runs. Set ALTER_CACHE to move it.
+    """
+    return Path(os.environ.get("ALTER_CACHE", ".alterable"))
+
+
+def format_size(size: float) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(size) < 1024 or unit == "GiB":
+            break
+        size /= 1024
+    return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
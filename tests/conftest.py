@@ -0,0 +1,36 @@
+import textwrap
+from pathlib import Path
+
+import pytest
+
+from alterable.buildsystem.cli import run_cli
+
+
+class Workspace:
+    """
+    A throwaway project: configuration, plugins and sources in a temporary
+    directory, with its own cache.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def write(self, name: str, text: str) -> Path:
+        path = self.root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(textwrap.dedent(text).lstrip())
+        return path
+
+    def read(self, name: str) -> str:
+        return (self.root / name).read_text()
+
+    def run(self, *argv: str) -> int:
+        return run_cli(list(argv))
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch) -> Workspace:
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("ALTER_CONF", str(tmp_path / "alter.yaml"))
+    monkeypatch.setenv("ALTER_CACHE", str(tmp_path / "cache"))
+    return Workspace(tmp_path)
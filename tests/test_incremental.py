@@ -0,0 +1,102 @@
+import json
+
+CONFIG = """
+collect:
+    rules:
+        - 'site'
+preprocess:
+    use:
+        - bang
+runner:
+    incremental: true
+buildsystem:
+    out:
+        use:
+            - keep
+plugins:
+    keep:
+        path: plug.py
+        pipeline:
+            target: project
+            entrypoint: keep
+    bang:
+        path: plug.py
+        pipeline:
+            target: file
+            match:
+                - '\\.txt$'
+            entrypoint: bang
+"""
+
+PLUGIN = """
+from pathlib import Path
+
+def keep(target, ctx):
+    pass
+
+def bang(target, ctx):
+    with open(Path(__file__).parent / "ran.log", "a") as log:
+        log.write(target.name + "\\n")
+    ctx.write(ctx.data.content + "!")
+"""
+
+
+def _ran(workspace) -> list[str]:
+    log = workspace.root / "ran.log"
+    ran = sorted(log.read_text().split()) if log.exists() else []
+    log.unlink(missing_ok=True)
+    return ran
+
+
+def _outputs(workspace) -> dict[str, str]:
+    return {
+        path.name: path.read_text()
+        for path in (workspace.root / "build/out/site").iterdir()
+    }
+
+
+def test_unchanged_files_are_restored(workspace):
+    workspace.write("alter.yaml", CONFIG)
+    workspace.write("plug.py", PLUGIN)
+    for i in range(3):
+        workspace.write(f"site/p{i}.txt", f"page {i}")
+    expected = {f"p{i}.txt": f"page {i}!" for i in range(3)}
+
+    assert workspace.run() == 0
+    assert _ran(workspace) == ["p0.txt", "p1.txt", "p2.txt"]
+    assert _outputs(workspace) == expected
+
+    assert workspace.run() == 0
+    assert _ran(workspace) == []
+    assert _outputs(workspace) == expected
+
+    workspace.write("site/p1.txt", "edited")
+    assert workspace.run() == 0
+    assert _ran(workspace) == ["p1.txt"]
+    assert _outputs(workspace) == {**expected, "p1.txt": "edited!"}
+
+    # a different plugin is a different step
+    workspace.write("plug.py", PLUGIN + "\n# changed\n")
+    assert workspace.run() == 0
+    assert _ran(workspace) == ["p0.txt", "p1.txt", "p2.txt"]
+
+
+def test_only_referenced_outputs_are_kept(workspace):
+    workspace.write("alter.yaml", CONFIG)
+    workspace.write("plug.py", PLUGIN)
+    workspace.write("site/page.txt", "first")
+    assert workspace.run() == 0
+    workspace.write("site/page.txt", "second")
+    assert workspace.run() == 0
+
+    manifest = json.loads(workspace.read("cache/manifest-preprocess.json"))
+    referenced = {
+        entry[1] for entries in manifest["steps"].values() for entry in entries.values()
+    }
+    stored = {
+        bucket.name + stored.name
+        for bucket in (workspace.root / "cache/objects").iterdir()
+        for stored in bucket.iterdir()
+    }
+    assert stored == referenced
+    assert len(stored) == 1
@@ -0,0 +1,12 @@
+from pathlib import Path
+
+from alterable.buildsystem.cli import load_project
+
+ROOT = Path(__file__).parent.parent
+
+
+def test_example_plan(monkeypatch, tmp_path):
+    monkeypatch.chdir(ROOT)
+    monkeypatch.setenv("ALTER_CACHE", str(tmp_path))
+    project = load_project("alter.yaml")
+    assert [step.name for step in project.preprocess] == ["z", "c5", "a5", "a4", "a3"]
@@ -0,0 +1,110 @@
+import concurrent.futures as futures
+import threading
+
+import pytest
+
+from alterable.buildsystem.runner import run_bounded
+
+CONFIG = """
+collect:
+    rules:
+        - 'site'
+preprocess:
+    use:
+        - check
+runner:
+    executor: {executor}
+    workers: 3
+    max_pending: 2
+buildsystem:
+    out:
+        use:
+            - keep
+plugins:
+    keep:
+        path: plug.py
+        pipeline:
+            target: project
+            entrypoint: keep
+    upper:
+        path: plug.py
+        pipeline:
+            target: file
+            match:
+                - '\\.txt$'
+            entrypoint: upper
+    check:
+        use:
+            - upper
+        path: plug.py
+        runner:
+            executor: serial
+        pipeline:
+            target: file
+            match:
+                - '\\.txt$'
+            entrypoint: check
+"""
+
+PLUGIN = """
+def keep(target, ctx):
+    pass
+
+def upper(target, ctx):
+    ctx.write(ctx.data.content.upper())
+
+def check(target, ctx):
+    assert ctx.data.content == ctx.data.content.upper()
+    ctx.write(ctx.data.content + "!")
+"""
+
+
+@pytest.mark.parametrize("executor", ["serial", "thread", "process"])
+def test_executors_agree(workspace, executor):
+    workspace.write("alter.yaml", CONFIG.format(executor=executor))
+    workspace.write("plug.py", PLUGIN)
+    for i in range(10):
+        workspace.write(f"site/p{i}.txt", f"page {i}")
+    assert workspace.run() == 0
+    for i in range(10):
+        assert workspace.read(f"build/out/site/p{i}.txt") == f"PAGE {i}!"
+
+
+def test_bounded_submission():
+    lock = threading.Lock()
+    running, most = 0, 0
+
+    def binding(i: int):
+        nonlocal running, most
+        with lock:
+            running += 1
+            most = max(most, running)
+        threading.Event().wait(0.01)
+        with lock:
+            running -= 1
+        return i * 2
+
+    results = {}
+    with futures.ThreadPoolExecutor(max_workers=8) as pool:
+        run_bounded(
+            pool,
+            (lambda i=i: binding(i) for i in range(20)),
+            3,
+            done=results.__setitem__,
+        )
+    assert results == {i: i * 2 for i in range(20)}
+    assert most <= 3
+
+
+def test_first_failure_cancels_the_rest():
+    started = []
+
+    def binding(i: int):
+        started.append(i)
+        if i == 0:
+            raise ValueError("bad file")
+
+    with futures.ThreadPoolExecutor(max_workers=1) as pool:
+        with pytest.raises(ValueError, match="bad file"):
+            run_bounded(pool, (lambda i=i: binding(i) for i in range(50)), 2)
+    assert len(started) < 50
@@ -0,0 +1,66 @@
+import os
+import stat
+
+import pytest
+
+from alterable.buildsystem import sandbox
+from alterable.buildsystem.sandbox import populate
+
+
+@pytest.fixture
+def sources(tmp_path):
+    site = tmp_path / "site"
+    site.mkdir()
+    for name in ("a.txt", "b.txt", "skip.bin"):
+        (site / name).write_text(f"source {name}")
+        os.chmod(site / name, 0o644)
+    return site
+
+
+@pytest.fixture
+def not_root(monkeypatch):
+    # hardlinks are never used as root
+    monkeypatch.setattr(sandbox, "_is_root", lambda: False)
+
+
+def test_hardlinked_sources_are_copied_before_writing(tmp_path, sources, not_root):
+    with populate([str(sources)], "hardlink", tmp_path / "cache") as tmpdir:
+        a, b = os.path.join(tmpdir, "site", "a.txt"), os.path.join(
+            tmpdir, "site", "b.txt"
+        )
+        assert os.stat(a).st_ino == os.stat(sources / "a.txt").st_ino
+        assert not os.stat(sources / "a.txt").st_mode & stat.S_IWUSR
+        with open(a, "w") as f:
+            f.write("edited")
+        os.truncate(b, 0)
+        assert os.stat(a).st_ino != os.stat(sources / "a.txt").st_ino
+        assert stat.S_IMODE(os.stat(a).st_mode) == 0o644
+    assert (sources / "a.txt").read_text() == "source a.txt"
+    assert (sources / "b.txt").read_text() == "source b.txt"
+    for name in ("a.txt", "b.txt", "skip.bin"):
+        assert stat.S_IMODE(os.stat(sources / name).st_mode) == 0o644
+
+
+def test_reading_keeps_the_links(tmp_path, sources, not_root):
+    with populate([str(sources)], "hardlink", tmp_path / "cache") as tmpdir:
+        a = os.path.join(tmpdir, "site", "a.txt")
+        with open(a) as f:
+            assert f.read() == "source a.txt"
+        assert os.stat(a).st_ino == os.stat(sources / "a.txt").st_ino
+
+
+def test_links_are_not_used_as_root(tmp_path, sources, monkeypatch):
+    monkeypatch.setattr(sandbox, "_is_root", lambda: True)
+    with populate([str(sources)], "hardlink", tmp_path / "cache") as tmpdir:
+        a = os.path.join(tmpdir, "site", "a.txt")
+        assert os.stat(a).st_ino != os.stat(sources / "a.txt").st_ino
+        assert os.stat(sources / "a.txt").st_mode & stat.S_IWUSR
+
+
+@pytest.mark.parametrize("mode", ["copy", "auto", "hardlink"])
+def test_excluded_files_are_left_out(tmp_path, sources, not_root, mode):
+    def exclude(path: str) -> bool:
+        return path.endswith(".bin")
+
+    with populate([str(sources)], mode, tmp_path / "cache", exclude) as tmpdir:
+        assert sorted(os.listdir(os.path.join(tmpdir, "site"))) == ["a.txt", "b.txt"]
@@ -0,0 +1,75 @@
+import threading
+
+import pytest
+
+from alterable.buildsystem.resolves import DependencyResolutionError, DepLoadStruct
+from alterable.buildsystem.runner import schedule
+
+# d needs b and c, which both need a
+PLAN = [
+    DepLoadStruct("a", set()),
+    DepLoadStruct("b", {"a"}),
+    DepLoadStruct("c", {"a"}),
+    DepLoadStruct("d", {"b", "c"}),
+]
+
+
+def _recorder(pause: float = 0.0):
+    lock = threading.Lock()
+    events: list[tuple[str, str]] = []
+
+    def run_one(name: str):
+        with lock:
+            events.append(("start", name))
+        threading.Event().wait(pause)
+        with lock:
+            events.append(("end", name))
+
+    return events, run_one
+
+
+def test_one_step_at_a_time_follows_the_load_order():
+    events, run_one = _recorder()
+    timings = schedule(PLAN, run_one, 1, set())
+    assert [name for kind, name in events if kind == "start"] == ["a", "b", "c", "d"]
+    assert set(timings) == {"a", "b", "c", "d"}
+
+
+def test_steps_wait_for_their_dependencies():
+    events, run_one = _recorder(0.02)
+    schedule(PLAN, run_one, 4, set())
+    position = {event: i for i, event in enumerate(events)}
+    for item in PLAN:
+        for dependency in item.load_after:
+            assert position[("end", dependency)] < position[("start", item.name)]
+    # b and c overlap
+    assert position[("start", "c")] < position[("end", "b")]
+
+
+def test_exclusive_steps_run_alone():
+    events, run_one = _recorder(0.02)
+    schedule(PLAN, run_one, 4, {"b"})
+    position = {event: i for i, event in enumerate(events)}
+    assert (
+        position[("end", "b")] < position[("start", "c")]
+        or position[("end", "c")] < position[("start", "b")]
+    )
+
+
+def test_failures_stop_dependents():
+    ran = []
+
+    def run_one(name: str):
+        ran.append(name)
+        if name == "b":
+            raise ValueError("bad step")
+
+    with pytest.raises(ValueError, match="bad step"):
+        schedule(PLAN, run_one, 4, set())
+    assert "d" not in ran
+
+
+def test_unsatisfiable_steps_are_reported():
+    plan = [DepLoadStruct("a", set()), DepLoadStruct("b", {"missing"})]
+    with pytest.raises(DependencyResolutionError, match="b"):
+        schedule(plan, lambda name: None, 1, set())
@@ -0,0 +1,43 @@
+from alterable.buildsystem.runner import RunnerOptions
+from alterable.plugins.shared_context import ProjectContext
+
+
+def _words(props) -> list[str]:
+    return props.content.split()
+
+
+def test_modified_values_outlive_the_memory_budget(tmp_path):
+    ctx = ProjectContext(memory_budget=1)
+    first, second = tmp_path / "first.txt", tmp_path / "second.txt"
+    first.write_text("a b")
+    second.write_text("c d")
+    for path in (first, second):
+        file = ctx.files[str(path)]
+        file.data.new_property("words", _words, cached=True)
+        file.write_back("words", " ".join)
+
+    edited = ctx.files[str(first)]
+    edited.data.words.append("e")
+    edited.mark_modified("words")
+    # over budget: everything not in use is evicted
+    assert ctx.files[str(second)].data.words == ["c", "d"]
+    ctx.end_step()
+    ctx.flush()
+    assert first.read_text() == "a b e"
+    assert second.read_text() == "c d"
+    ctx.close()
+
+
+def test_file_contents_count_against_the_budget(tmp_path):
+    ctx = ProjectContext(memory_budget=10_000)
+    for i in range(20):
+        path = tmp_path / f"p{i}.txt"
+        path.write_text(str(i) * 2_000)
+        assert ctx.files[str(path)].data.content == str(i) * 2_000
+    assert ctx.memory.total <= 10_000
+    assert ctx.memory.evictions > 0
+    ctx.close()
+
+
+def test_runner_budget_is_limited_by_default():
+    assert RunnerOptions.load({}).memory_budget is not None
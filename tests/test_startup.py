@@ -0,0 +1,7 @@
+from alterable.buildsystem.startup import measure
+
+
+def test_startup_defers_heavy_imports():
+    imported = {name.split(".")[0] for name, _, _ in measure()}
+    assert "rich" not in imported
+    assert "strictyaml" not in imported
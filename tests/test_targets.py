@@ -0,0 +1,143 @@
+import os
+import stat
+
+from alterable.buildsystem.incremental import BuildManifest, prune_objects
+from alterable.buildsystem.store import TEMP_PREFIX, ObjectStore
+
+CONFIG = """
+collect:
+    rules:
+        - 'site'
+runner:
+    incremental: true
+buildsystem:
+    {targets}
+plugins:
+    {plugins}
+"""
+
+TARGET = """
+    {name}:
+        use:
+            - {name}
+"""
+
+PLUGIN = """
+    {name}:
+        path: plug.py
+        pipeline:
+            target: file
+            match:
+                - '\\.txt$'
+            entrypoint: {name}
+"""
+
+NAMES = ["one", "two", "three", "four"]
+
+
+def _project(workspace, pages: int):
+    workspace.write(
+        "plug.py",
+        "\n".join(
+            f"def {name}(target, ctx):\n"
+            f"    target.write_text(target.read_text() + {name!r})\n"
+            for name in NAMES
+        ),
+    )
+    workspace.write(
+        "alter.yaml",
+        CONFIG.format(
+            targets="".join(TARGET.format(name=name) for name in NAMES).strip(),
+            plugins="".join(PLUGIN.format(name=name) for name in NAMES).strip(),
+        ),
+    )
+    for i in range(pages):
+        # big enough that storing the outputs takes a while
+        workspace.write(f"site/p{i}.txt", f"page {i} " + "." * 20000 * (i % 3))
+
+
+def test_incremental_targets_share_the_store(workspace):
+    _project(workspace, 60)
+    for _ in range(3):
+        assert workspace.run() == 0
+        for name in NAMES:
+            assert workspace.read(f"build/{name}/site/p6.txt") == f"page 6 {name}"
+    workspace.write("site/p6.txt", "changed ")
+    assert workspace.run() == 0
+    for name in NAMES:
+        assert workspace.read(f"build/{name}/site/p6.txt") == f"changed {name}"
+        assert workspace.read(f"build/{name}/site/p9.txt") == f"page 9 {name}"
+
+
+def test_prune_keeps_objects_being_added(tmp_path):
+    store = ObjectStore(tmp_path)
+    source = tmp_path.parent / "source.txt"
+    source.write_text("kept")
+    store.add(source, "ab" + "0" * 62)
+    store.add(source, "cd" + "0" * 62)
+    in_flight = tmp_path / "ef" / f"{TEMP_PREFIX}partial"
+    in_flight.parent.mkdir()
+    in_flight.write_text("half")
+    store.prune({"ab" + "0" * 62})
+    assert ("ab" + "0" * 62) in store
+    assert ("cd" + "0" * 62) not in store
+    assert in_flight.exists()
+
+
+def test_saving_a_manifest_leaves_other_objects(tmp_path):
+    # another target's worker may have stored this without saving yet
+    (tmp_path / "sandbox").mkdir()
+    source = tmp_path / "source.txt"
+    source.write_text("elsewhere")
+    manifest = BuildManifest.load(tmp_path / "cache", "build-a", tmp_path / "sandbox")
+    manifest.store(source, "ab" + "0" * 62)
+    manifest.save()
+    assert ("ab" + "0" * 62) in manifest.objects
+    prune_objects(tmp_path / "cache")
+    assert ("ab" + "0" * 62) not in manifest.objects
+
+
+STORE_CONFIG = """
+collect:
+    rules:
+        - 'site'
+runner:
+    output: store
+buildsystem:
+    full:
+        use:
+            - one
+    small:
+        use:
+            - one
+        exclude:
+            - 'big\\.txt$'
+        output: out/small
+plugins:
+    one:
+        path: plug.py
+        pipeline:
+            target: file
+            match:
+                - '\\.txt$'
+            entrypoint: one
+"""
+
+
+def test_targets_share_stored_outputs(workspace):
+    workspace.write("alter.yaml", STORE_CONFIG)
+    workspace.write(
+        "plug.py",
+        "def one(target, ctx):\n    ctx.write(ctx.data.content + 'one')\n",
+    )
+    workspace.write("site/page.txt", "page ")
+    workspace.write("site/big.txt", "big ")
+    assert workspace.run() == 0
+
+    full, small = workspace.root / "build/full/site", workspace.root / "out/small/site"
+    assert sorted(os.listdir(full)) == ["big.txt", "page.txt"]
+    assert os.listdir(small) == ["page.txt"]
+    assert (small / "page.txt").read_text() == "page one"
+    # one stored copy, linked from both targets
+    assert os.stat(full / "page.txt").st_ino == os.stat(small / "page.txt").st_ino
+    assert not os.stat(full / "page.txt").st_mode & stat.S_IWUSR
@@ -0,0 +1,123 @@
+import os
+import pickle
+
+from alterable.plugins import transfer
+from alterable.plugins.shared_context import FileContext, ProjectContext
+
+
+def _words(props) -> list[str]:
+    return props.content.split()
+
+
+def pid_words(props) -> tuple[int, list[str]]:
+    # providers have to be importable for workers to send them back
+    return os.getpid(), props.content.split()
+
+
+def _send(state: transfer.FileState) -> transfer.FileState:
+    return pickle.loads(pickle.dumps(state))
+
+
+def test_values_computed_in_a_worker_come_back(tmp_path):
+    path = tmp_path / "page.txt"
+    path.write_text("a b c")
+    ctx = ProjectContext()
+    file = ctx.files[str(path)]
+    file.data.new_property("words", _words, cached=True)
+    file.data.new_property("tree", _words, cached=True, local=True)
+    assert file.data.tree == ["a", "b", "c"]
+
+    sent = file.export(values=())
+    assert sent.cache == {}
+    remote = FileContext.restore(_send(sent))
+    assert remote.data.words == ["a", "b", "c"]
+    assert remote.data.tree == ["a", "b", "c"]
+    returned = _send(remote.export())
+    assert set(returned.cache) == {"words"}
+
+    file.merge(returned, sent)
+    assert file.data.words == ["a", "b", "c"]
+    # computed once, over there
+    assert ctx.cache_stats.misses["words"] == 1
+    assert ctx.cache_stats.hits["words"] == 1
+    ctx.close()
+
+
+def test_large_writes_come_back_through_shared_memory(tmp_path):
+    path = tmp_path / "page.txt"
+    path.write_text("small")
+    ctx = ProjectContext()
+    file = ctx.files[str(path)]
+    big = b"x" * (transfer.SHARED_THRESHOLD * 2)
+
+    sent = file.export([], values=())
+    remote = FileContext.restore(_send(sent))
+    remote.write(big)
+    shared: list[transfer.SharedBytes] = []
+    returned = remote.export(shared)
+    assert isinstance(returned.pending, transfer.SharedBytes)
+    for block in shared:
+        block.hand_over()
+    remote.close()
+
+    file.merge(_send(returned), sent)
+    assert file.data.raw == big
+    ctx.flush()
+    assert path.read_bytes() == big
+    ctx.close()
+
+
+CONFIG = """
+collect:
+    rules:
+        - 'site'
+preprocess:
+    use:
+        - check
+runner:
+    executor: process
+    workers: 2
+plugins:
+    count:
+        path: plug.py
+        pipeline:
+            target: file
+            match:
+                - '\\.txt$'
+            entrypoint: count
+    check:
+        use:
+            - count
+        path: plug.py
+        runner:
+            executor: serial
+        pipeline:
+            target: file
+            match:
+                - '\\.txt$'
+            entrypoint: check
+"""
+
+PLUGIN = """
+import os
+
+from test_transfer import pid_words
+
+def count(target, ctx):
+    ctx.data.new_property("words", pid_words, cached=True)
+    ctx.data.words
+
+def check(target, ctx):
+    # computed by the worker that ran count, not again here
+    pid, found = ctx.data.words
+    assert pid != os.getpid(), "words computed again"
+    assert found == target.read_text().split()
+"""
+
+
+def test_process_workers_send_their_values_back(workspace):
+    workspace.write("alter.yaml", CONFIG)
+    workspace.write("plug.py", PLUGIN)
+    for i in range(4):
+        workspace.write(f"site/p{i}.txt", f"page {i}")
+    assert workspace.run() == 0
@@ -0,0 +1,86 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from alterable.buildsystem.cli import collect, load_project, prepare_env, preprocess
+from alterable.buildsystem.watch import SourceWatcher, rebuild
+from alterable.plugins.shared_context import ProjectContext
+
+CONFIG = """
+collect:
+    rules:
+        - 'site'
+preprocess:
+    use:
+        - {last}
+plugins:
+    bang:
+        {bang_use}
+        path: plug.py
+        pipeline:
+            target: file
+            match:
+                - '\\.txt$'
+            entrypoint: bang
+    count:
+        {count_use}
+        path: plug.py
+        pipeline:
+            target: project
+            entrypoint: count
+"""
+
+PLUGIN = """
+def bang(target, ctx):
+    target.write_text(target.read_text() + "!")
+
+def count(target, ctx):
+    pages = (target / "site").glob("*.txt")
+    banged = sum(page.read_text().endswith("!") for page in pages)
+    (target / "count.out").write_text(str(banged))
+"""
+
+
+def _snapshot(root: Path) -> dict[str, str]:
+    return {
+        os.path.relpath(os.path.join(dir_path, name), root): Path(
+            dir_path, name
+        ).read_text()
+        for dir_path, _, filenames in os.walk(root)
+        for name in filenames
+    }
+
+
+@pytest.mark.parametrize("count_first", [True, False])
+def test_rebuild_matches_a_clean_build(workspace, count_first):
+    use = "use:\n            - {}"
+    workspace.write(
+        "alter.yaml",
+        CONFIG.format(
+            last="bang" if count_first else "count",
+            bang_use=use.format("count") if count_first else "",
+            count_use="" if count_first else use.format("bang"),
+        ),
+    )
+    workspace.write("plug.py", PLUGIN)
+    for i in range(4):
+        workspace.write(f"site/p{i}.txt", f"page {i}")
+    project = load_project("alter.yaml")
+    watcher = SourceWatcher(project.rules)
+
+    with prepare_env(collect(project.rules)) as presrc:
+        sandbox, ctx, written = Path(presrc), ProjectContext(), set()
+        assert preprocess(project, sandbox, ctx, written=written)
+        for edit in ("edited", "edited again"):
+            workspace.write("site/p1.txt", edit)
+            changed = watcher.poll()
+            assert changed
+            assert rebuild(project, watcher, sandbox, ctx, changed, written)
+        rebuilt = _snapshot(sandbox)
+        ctx.close()
+
+    with prepare_env(collect(project.rules)) as presrc:
+        assert preprocess(project, Path(presrc))
+        assert rebuilt == _snapshot(Path(presrc))
+    assert rebuilt["count.out"] == ("0" if count_first else "4")
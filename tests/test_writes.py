@@ -0,0 +1,84 @@
+import pytest
+
+from alterable.plugins.shared_context import ProjectContext
+
+CONFIG = """
+collect:
+    rules:
+        - 'site'
+runner:
+    incremental: true
+    flush: {flush}
+buildsystem:
+    out:
+        use:
+            - bang
+plugins:
+    one:
+        path: plug.py
+        runner:
+            incremental: false
+        pipeline:
+            target: file
+            match:
+                - '\\.txt$'
+            entrypoint: one
+    bang:
+        use:
+            - one
+        path: plug.py
+        pipeline:
+            target: file
+            match:
+                - '\\.txt$'
+            entrypoint: bang
+"""
+
+PLUGIN = """
+def one(target, ctx):
+    ctx.write(ctx.data.content + "1")
+
+def bang(target, ctx):
+    ctx.write(ctx.data.content + "!")
+"""
+
+
+@pytest.mark.parametrize("flush", ["step", "end"])
+def test_buffered_writes_reach_the_output(workspace, flush):
+    workspace.write("alter.yaml", CONFIG.format(flush=flush))
+    workspace.write("plug.py", PLUGIN)
+    workspace.write("site/page.txt", "F")
+    for _ in range(3):
+        assert workspace.run() == 0
+        assert workspace.read("build/out/site/page.txt") == "F1!"
+
+
+def test_writes_are_visible_before_they_are_saved(tmp_path):
+    path = tmp_path / "page.txt"
+    path.write_text("old")
+    ctx = ProjectContext()
+    file = ctx.files[str(path)]
+    assert file.data.content == "old"
+    file.write("new")
+    assert file.data.content == "new"
+    assert bytes(file.data.buffer) == b"new"
+    assert path.read_text() == "old"
+    ctx.flush()
+    assert path.read_text() == "new"
+    assert file.data.content == "new"
+    assert ctx.writes.written == 1
+    ctx.close()
+
+
+def test_write_buffer_saves_once_over_its_limit(tmp_path):
+    ctx = ProjectContext(write_buffer=10)
+    paths = [tmp_path / f"p{i}.txt" for i in range(3)]
+    for path in paths:
+        path.write_text("")
+    ctx.files[str(paths[0])].write("12345")
+    ctx.files[str(paths[1])].write("12345")
+    assert [path.read_text() for path in paths] == ["", "", ""]
+    ctx.files[str(paths[2])].write("1")
+    assert [path.read_text() for path in paths] == ["12345", "12345", "1"]
+    assert ctx.writes.pending == 0
+    ctx.close()